@@ -0,0 +1,14 @@
+""" The user that writes in the current call are audited as, see `models.AuditTrailModel` """
+import threading
+
+
+_local = threading.local()
+
+
+def set_audit_user(sub):
+    """ The user (JWT `sub`) that writes to AuditTrailModels are stamped with, None to clear it """
+    _local.user = sub
+
+
+def get_audit_user():
+    return getattr(_local, "user", None)
@@ -8,8 +8,6 @@ from uuid import uuid4
 from nameko.events import EventDispatcher
 from nameko.dependency_providers import Config
 
-from cid import locals
-
 
 """
 A mixin class for dispatching events and including a CID.
@@ -24,6 +22,8 @@ class EventDispatchWithCidMixin(object):
             # Dispatch event
             self.dispatch_event("user_created", {"email": email, "uuid": uuid})
 
+    Oversized event data is claim-checked when CLAIM_CHECK is configured, see `rpc.claim_check`.
+
     """
     logger = logging.getLogger(__name__)
     # Nameko Config is a simple dependency provider
@@ -33,10 +33,18 @@ class EventDispatchWithCidMixin(object):
 
     def dispatch_event(self, event_name: str, event_data: dict):
         """ Dispatch event """
+        # Imported on first use, the Nameko providers above are all the class needs to be defined.
+        from cid import locals
+
+        from ..rpc.claim_check import offload_payload
+        from ..tracing.tracer import propagate_trace
+
         self.logger.debug("Dispatching event: %s, event data: %s", event_name, json.dumps(event_data))
 
         # Get the correlation ID if it exists, otherwise create one
         cid = locals.get_cid() or str(uuid4())
+        event_data = offload_payload(event_data)
         event_data["cid"] = cid
+        propagate_trace(event_data)
 
         self.dispatch(event_name, event_data)
@@ -1,23 +1,28 @@
 #pylint:disable=W0622
-""" Decorator for Nameko event handler """
+""" Decorator for Nameko event handler, Nameko and the helpers are imported when it is applied """
 from uuid import uuid4
 
-from nameko.events import event_handler as nameko_event_handler
-
-from cid import locals
-
 
 def event_handler_decorator_with_cid(channel_name: str, event_name: str, *args, **kwargs):
     """ Wrap a Namkeo event handler """
     def decorator_wrapper(function):
         """ Wrapper function for the decorator """
+        from nameko.events import event_handler as nameko_event_handler
+
+        from cid import locals
+
+        from ..rpc.claim_check import fetch_payload
+        from ..tracing.tracer import CONSUMER, trace_span
+
         @nameko_event_handler(channel_name, event_name, *args, **kwargs)
         def wrapper(self, event_data):
             """ Function wrapper """
             # get the CID off of the event data and set it on the local thread
             locals.set_cid(event_data.pop("cid", str(uuid4())))
+            parent = event_data.pop("trace", None)
 
-            return function(self, event_data)
+            with trace_span(event_name, CONSUMER, parent, {"event.source": channel_name}):
+                return function(self, fetch_payload(event_data))
 
         return wrapper
 
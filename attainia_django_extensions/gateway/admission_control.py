@@ -0,0 +1,247 @@
+"""
+Per-tenant admission control and load shedding for the HTTP gateway.
+
+    A token bucket per org (the JWT `org` claim), optionally per service and action too, admits
+    requests before any RPC is issued. Rejected requests get a 429 with a Retry-After header.
+
+    When a service's latency goes over LATENCY_THRESHOLD, or its circuit isn't closed, every request
+    to it costs more tokens, so each org's rate shrinks in proportion until the service recovers.
+
+        ADMISSION_CONTROL = {
+            "RATE": 50,                        # tokens per second
+            "BURST": 100,                      # bucket size
+            "KEY_BY": ["org"],                 # any of "org", "service", "action"
+            "RATES": {"<org>": {"RATE": 200, "BURST": 400}},
+            "STORE": "local",                  # or "cache" to share the buckets between gateway instances
+            "CACHE": "default",
+            "SHEDDING": {
+                "ENABLED": True,
+                "LATENCY_PERCENTILE": 95,
+                "LATENCY_THRESHOLD": 1.0,      # seconds
+                "MIN_SAMPLES": 20,
+                "MIN_ADMIT_RATIO": 0.1,
+            },
+        }
+
+    Add the throttle to a viewset, or to DRF's DEFAULT_THROTTLE_CLASSES:
+
+        class AssetViewset(HttpRpcViewset):
+            rpc_service_name = "asset_service"
+            throttle_classes = [AdmissionControlThrottle]
+
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from rest_framework.throttling import BaseThrottle
+
+from ..rpc.circuit_breaker import CircuitBreaker, get_circuit_state
+from ..rpc.hedged_call import latency_tracker
+
+
+class LocalBucketStore(object):
+    """
+    Token buckets in process memory, each gateway instance admits its own share. Buckets that have
+    refilled are dropped, a full bucket is the same as a new one, so idle keys (e.g. the client IPs
+    of anonymous requests) don't pile up.
+    """
+
+    def __init__(self, sweep_interval: float = 60):
+        # key -> (tokens, updated at, full at)
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.sweep_interval = sweep_interval
+        self._swept_at = time.monotonic()
+
+    def consume(self, key, rate: float, burst: float, cost: float = 1.0) -> float:
+        """ Take `cost` tokens from the bucket, returns 0 if admitted, otherwise seconds until it would be """
+        now = time.monotonic()
+
+        with self._lock:
+            if now - self._swept_at >= self.sweep_interval:
+                self._sweep(now)
+
+            tokens, updated_at, _ = self._buckets.get(key, (burst, now, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            admitted = tokens >= cost
+
+            if admitted:
+                tokens -= cost
+
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+
+        return 0.0 if admitted else (cost - tokens) / rate
+
+    def _sweep(self, now):
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if bucket[2] > now}
+        self._swept_at = now
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class CacheBucketStore(object):
+    """
+    Token buckets in the Django cache, shared by every gateway instance. Like DRF's own throttles
+    the read and write aren't atomic, so concurrent requests may be admitted slightly over the rate.
+    """
+    key_prefix = "admission_control:"
+
+    def __init__(self, cache_alias="default"):
+        self.cache_alias = cache_alias
+
+    def _get_cache(self):
+        from django.core.cache import caches
+
+        return caches[self.cache_alias]
+
+    def consume(self, key, rate: float, burst: float, cost: float = 1.0) -> float:
+        cache = self._get_cache()
+        cache_key = self.key_prefix + ":".join(str(part) for part in key)
+        now = time.time()
+
+        tokens, updated_at = cache.get(cache_key, (burst, now))
+        tokens = min(burst, tokens + max(0.0, now - updated_at) * rate)
+        # Keep the bucket around until it would have refilled anyway.
+        timeout = int(burst / rate) + 1
+
+        if tokens >= cost:
+            cache.set(cache_key, (tokens - cost, now), timeout)
+            return 0.0
+
+        cache.set(cache_key, (tokens, now), timeout)
+
+        return (cost - tokens) / rate
+
+
+class AdmissionController(object):
+    """ Decides whether a tenant's request to a service is admitted """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, store, rate: float = 50, burst: float = 100, key_by=("org",), rates=None, shedding=None):
+        self.store = store
+        self.rate = rate
+        self.burst = burst
+        self.key_by = tuple(key_by)
+        self.rates = rates or {}
+        self.shedding = shedding or {}
+
+    def get_rate(self, org):
+        """ The (rate, burst) for an org """
+        org_rate = self.rates.get(org, {})
+
+        return org_rate.get("RATE", self.rate), org_rate.get("BURST", self.burst)
+
+    def get_admit_ratio(self, service_name, action) -> float:
+        """ Fraction of the normal rate to admit, 1 while the service is healthy """
+        if not self.shedding.get("ENABLED", True) or service_name is None:
+            return 1.0
+
+        min_ratio = self.shedding.get("MIN_ADMIT_RATIO", 0.1)
+
+        if get_circuit_state(service_name) != CircuitBreaker.CLOSED:
+            return min_ratio
+
+        threshold = self.shedding.get("LATENCY_THRESHOLD")
+
+        if not threshold or action is None:
+            return 1.0
+
+        latency = latency_tracker.percentile(
+            (service_name, action),
+            self.shedding.get("LATENCY_PERCENTILE", 95),
+            self.shedding.get("MIN_SAMPLES", 20),
+        )
+
+        if latency is None or latency <= threshold:
+            return 1.0
+
+        return max(min_ratio, threshold / latency)
+
+    def admit(self, org, service_name=None, action=None) -> float:
+        """ Returns 0 if the request is admitted, otherwise the seconds to wait before retrying """
+        parts = {"org": org, "service": service_name, "action": action}
+        key = tuple(parts[name] for name in self.key_by)
+        rate, burst = self.get_rate(org)
+        admit_ratio = self.get_admit_ratio(service_name, action)
+
+        # A request can't cost more than a full bucket, or it would never be admitted.
+        wait = self.store.consume(key, rate, burst, min(burst, 1.0 / admit_ratio))
+
+        if wait:
+            self.logger.info(
+                "Request rejected for org: %s, service: %s, action: %s, admit ratio: %.2f",
+                org, service_name, action, admit_ratio
+            )
+
+        return wait
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller():
+    """ Process wide controller built from the ADMISSION_CONTROL setting, or None if it isn't configured """
+    global _controller
+
+    admission_settings = getattr(settings, "ADMISSION_CONTROL", None)
+
+    if not admission_settings:
+        return None
+
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                if admission_settings.get("STORE", "local") == "cache":
+                    store = CacheBucketStore(admission_settings.get("CACHE", "default"))
+                else:
+                    store = LocalBucketStore()
+
+                _controller = AdmissionController(
+                    store,
+                    rate=admission_settings.get("RATE", 50),
+                    burst=admission_settings.get("BURST", 100),
+                    key_by=admission_settings.get("KEY_BY", ["org"]),
+                    rates=admission_settings.get("RATES", {}),
+                    shedding=admission_settings.get("SHEDDING", {}),
+                )
+
+    return _controller
+
+
+class AdmissionControlThrottle(BaseThrottle):
+    """ DRF throttle admitting requests through the process wide AdmissionController """
+    wait_time = None
+
+    def get_org(self, request):
+        """ The tenant to admit the request as, requests without an org claim are keyed by client IP """
+        user = getattr(request, "user", None)
+        org = user.get("org") if isinstance(user, dict) else None
+
+        return org or self.get_ident(request)
+
+    def get_service_name(self, view):
+        get_rpc_service_name = getattr(view, "get_rpc_service_name", None)
+
+        return get_rpc_service_name() if get_rpc_service_name is not None else None
+
+    def allow_request(self, request, view):
+        controller = get_admission_controller()
+
+        if controller is None:
+            return True
+
+        self.wait_time = controller.admit(
+            self.get_org(request),
+            self.get_service_name(view),
+            getattr(view, "action", None),
+        )
+
+        return not self.wait_time
+
+    def wait(self):
+        return self.wait_time
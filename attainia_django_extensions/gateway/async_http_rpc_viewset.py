@@ -0,0 +1,195 @@
+""" Async (ASGI) HTTP Gateway Viewset for Nameko RPC services """
+import json
+
+from django.http import HttpResponseNotAllowed
+from django.urls import path
+from django.views import View
+
+from ..rpc import rpc_errors
+from ..rpc.async_rpc_with_cid_mixin import AsyncRpcWithCidMixin
+from .http_rpc_viewset import querydict_to_dict
+from .rpc_http_error_marshaller import async_rpc_http_error_marshaller
+
+
+class AsyncHttpRpcViewset(View, AsyncRpcWithCidMixin):
+    """
+    An async Django view that provides the same CRUDL and search HTTP API gateway as HttpRpcViewset,
+    awaiting RPC replies instead of holding a worker thread for the round trip.
+
+    Requires Django's async class-based views (Django 4.1+) served under ASGI.
+
+        urlpatterns = [
+            *AssetViewset.get_urls("assets"),
+        ]
+
+    """
+    rpc_service_name = None
+    http_method_names = ["get", "post", "put", "patch", "delete"]
+
+    @classmethod
+    def get_urls(cls, prefix):
+        view = cls.as_view()
+
+        return [
+            path("{0}/".format(prefix), view),
+            path("{0}/search/".format(prefix), view, {"action": "search"}),
+            path("{0}/<pk>/".format(prefix), view),
+        ]
+
+    def _getJwt(self, request):
+        jwt = None
+
+        try:
+            jwt = request.META.get("HTTP_AUTHORIZATION", "").split()[1]
+        except Exception as ex:
+            jwt = None
+
+        return jwt
+
+    def _get_request_data(self, request):
+        """ The JSON object in the request body, raises ValueError for anything else """
+        try:
+            data = json.loads(request.body.decode("utf-8") or "{}")
+        except ValueError as ex:
+            raise ValueError("JSON parse error - {0}".format(ex))
+
+        if not isinstance(data, dict):
+            raise ValueError("Expected a JSON object in the request body")
+
+        return data
+
+    def _invalid_request_data(self, ex):
+        return {rpc_errors.VALIDATION_ERRORS_KEY: {"non_field_errors": [str(ex)]}}
+
+    def get_rpc_service_name(self):
+        assert self.rpc_service_name is not None, (
+            "'%s' should either include a `rpc_service_name` attribute, "
+            "or override the `get_rpc_service_name()` method."
+            % self.__class__.__name__
+        )
+
+        rpc_service_name = self.rpc_service_name
+        return rpc_service_name
+
+    async def get(self, request, pk=None, action=None):
+        if action == "search":
+            return await self.search(request)
+
+        if pk is None:
+            return await self.list(request)
+
+        return await self.retrieve(request, pk)
+
+    async def post(self, request, pk=None, action=None):
+        if pk is not None or action is not None:
+            return self._method_not_allowed(pk, action)
+
+        return await self.create(request)
+
+    async def put(self, request, pk=None, action=None):
+        if pk is None:
+            return self._method_not_allowed(pk, action)
+
+        return await self.update(request, pk)
+
+    async def patch(self, request, pk=None, action=None):
+        if pk is None:
+            return self._method_not_allowed(pk, action)
+
+        return await self.update(request, pk, partial=True)
+
+    async def delete(self, request, pk=None, action=None):
+        if pk is None:
+            return self._method_not_allowed(pk, action)
+
+        return await self.destroy(request, pk)
+
+    def _method_not_allowed(self, pk, action):
+        """ 405 with the methods the route does allow """
+        if action == "search":
+            return HttpResponseNotAllowed(["GET"])
+
+        if pk is not None:
+            return HttpResponseNotAllowed(["GET", "PUT", "PATCH", "DELETE"])
+
+        return HttpResponseNotAllowed(["GET", "POST"])
+
+    @async_rpc_http_error_marshaller
+    async def search(self, request, *args, **kwargs):
+        jwt = self._getJwt(request)
+        params = querydict_to_dict(request.GET)
+
+        return await self.call_service_method(
+            self.get_rpc_service_name(),
+            "search",
+            **{**{"jwt": jwt}, **params},
+        )
+
+    @async_rpc_http_error_marshaller
+    async def list(self, request, *args, **kwargs):
+        jwt = self._getJwt(request)
+        params = querydict_to_dict(request.GET)
+
+        return await self.call_service_method(
+            self.get_rpc_service_name(),
+            "list",
+            **{**{"jwt": jwt}, **params},
+        )
+
+    @async_rpc_http_error_marshaller
+    async def retrieve(self, request, pk, *args, **kwargs):
+        jwt = self._getJwt(request)
+        params = querydict_to_dict(request.GET)
+
+        return await self.call_service_method(
+            self.get_rpc_service_name(),
+            "retrieve",
+            **{**{"jwt": jwt}, **{"pk": pk}, **params},
+        )
+
+    @async_rpc_http_error_marshaller
+    async def create(self, request, *args, **kwargs):
+        jwt = self._getJwt(request)
+
+        try:
+            request_data = self._get_request_data(request)
+        except ValueError as ex:
+            return self._invalid_request_data(ex)
+
+        return await self.call_service_method(
+            self.get_rpc_service_name(),
+            "create",
+            **{**{"jwt": jwt}, **request_data}
+        )
+
+    @async_rpc_http_error_marshaller
+    async def update(self, request, pk, *args, **kwargs):
+        jwt = self._getJwt(request)
+
+        try:
+            request_data = self._get_request_data(request)
+        except ValueError as ex:
+            return self._invalid_request_data(ex)
+
+        request_data["partial"] = kwargs.pop("partial", False)
+
+        return await self.call_service_method(
+            self.get_rpc_service_name(),
+            "update",
+            **{**{"jwt": jwt}, **{"pk": pk}, **request_data}
+        )
+
+    @async_rpc_http_error_marshaller
+    async def destroy(self, request, pk, *args, **kwargs):
+        jwt = self._getJwt(request)
+
+        try:
+            request_data = self._get_request_data(request)
+        except ValueError as ex:
+            return self._invalid_request_data(ex)
+
+        return await self.call_service_method(
+            self.get_rpc_service_name(),
+            "delete",
+            **{**{"jwt": jwt}, **{"pk": pk}, **request_data}
+        )
@@ -1,10 +1,22 @@
 """ HTTP Gateway Viewset for Nameko RPC services """
+import hashlib
+import json
+import logging
+
 from rest_framework import viewsets
 from rest_framework.authentication import get_authorization_header
 from rest_framework.decorators import list_route
 
+from django.conf import settings
+
+from cid import locals
+
+from ..rpc.claims_envelope import sign_claims
+from ..rpc.deadline import remaining_time
+from ..rpc import rpc_errors
 from ..rpc.django_rpc_with_cid_mixin import DjangoRpcWithCidMixin
 from .rpc_http_error_marshaller import rpc_http_error_marshaller
+from .single_flight import single_flight
 
 
 def querydict_to_dict(querydict):
@@ -15,8 +27,30 @@ class HttpRpcViewset(viewsets.ViewSet, DjangoRpcWithCidMixin):
     """
     A DRF based ViewSet base class that provides a CRUDL HTTP API gateway
     to interact with Nameko RPC calls.
+
+    Set `coalesce_reads = True` to let concurrent identical list, retrieve and search requests share
+    a single RPC, see `single_flight`.
+
+    Add `AdmissionControlThrottle` to `throttle_classes` to rate limit each org before any RPC is
+    issued, see `admission_control`.
+
+    List, retrieve and search take an `expand` parameter, e.g. `?expand=created_by,modified_by`,
+    to inline the objects those IDs refer to. Each expandable field names the service that owns it,
+    and the IDs of a response are fetched with one `retrieve_many` call per service.
+
+        expand_fields = {
+            "created_by": "user_service",
+            "modified_by": "user_service",
+        }
+
     """
+    logger = logging.getLogger(__name__)
     rpc_service_name = None
+    coalesce_reads = False
+    expand_fields = {}
+    # IDs per retrieve_many call, by default and at most PAGINATION["MAX_PAGE_SIZE"], which the
+    # services share with the gateway.
+    expand_batch_size = None
 
     def _getJwt(self, request):
         jwt = None
@@ -28,6 +62,151 @@ class HttpRpcViewset(viewsets.ViewSet, DjangoRpcWithCidMixin):
 
         return jwt
 
+    def _get_claims_envelope(self, request):
+        """
+        Sign the claims of a request authenticated by the gateway (e.g. with JwtAuthentication),
+        so the service can skip authenticating the JWT again.
+        """
+        envelope_settings = getattr(settings, "CLAIMS_ENVELOPE", {})
+        signing_key = envelope_settings.get("SIGNING_KEY")
+        claims = getattr(request, "user", None)
+
+        if not signing_key or not isinstance(claims, dict):
+            return None
+
+        return sign_claims(claims, signing_key, locals.get_cid(), envelope_settings.get("TTL", 30))
+
+    def _get_auth_kwargs(self, request):
+        auth_kwargs = {"jwt": self._getJwt(request)}
+        envelope = self._get_claims_envelope(request)
+
+        if envelope is not None:
+            auth_kwargs["claims"] = envelope
+
+        return auth_kwargs
+
+    def get_coalesce_auth_key(self, request):
+        """
+        Requests are only coalesced when they are authorized the same way. By default that means
+        the same JWT, override to share replies more widely (e.g. by org and scopes).
+        """
+        jwt = self._getJwt(request) or ""
+        return hashlib.sha256(jwt.encode("utf-8")).hexdigest()
+
+    def get_expand(self, kwargs):
+        """ Pop the `expand` parameter, keeping only the fields that can be expanded """
+        expand = kwargs.pop("expand", None) or []
+
+        if isinstance(expand, str):
+            expand = expand.split(",")
+
+        return [field.strip() for field in expand if field.strip() in self.expand_fields]
+
+    def get_expand_batch_size(self):
+        max_page_size = getattr(settings, "PAGINATION", {}).get("MAX_PAGE_SIZE")
+        batch_size = self.expand_batch_size or max_page_size or 100
+
+        return min(batch_size, max_page_size) if max_page_size else batch_size
+
+    def _get_expand_cache(self, request):
+        """ Objects fetched for expansion during this request, by (service, ID) """
+        cache = getattr(request, "_expand_cache", None)
+
+        if cache is None:
+            cache = request._expand_cache = {}
+
+        return cache
+
+    def expand_relations(self, request, auth_kwargs, resp, expand):
+        """ Replace the IDs in the expanded fields of a response with the objects they refer to """
+        if not expand or not isinstance(resp, dict) or rpc_errors.ERRORS_KEY in resp:
+            return resp
+
+        rows = resp.get("results") if isinstance(resp.get("results"), list) else [resp]
+        cache = self._get_expand_cache(request)
+        ids_by_service = {}
+
+        for field in expand:
+            service_name = self.expand_fields[field]
+
+            for row in rows:
+                value = row.get(field) if isinstance(row, dict) else None
+                values = value if isinstance(value, list) else [value]
+
+                for pk in values:
+                    if isinstance(pk, (str, int)) and (service_name, str(pk)) not in cache:
+                        ids_by_service.setdefault(service_name, set()).add(str(pk))
+
+        batch_size = self.get_expand_batch_size()
+
+        for service_name, ids in ids_by_service.items():
+            ids = sorted(ids)
+
+            for start in range(0, len(ids), batch_size):
+                try:
+                    objects = self.call_service_method(
+                        service_name,
+                        "retrieve_many",
+                        False,
+                        **{**auth_kwargs, **{"ids": ids[start:start + batch_size]}}
+                    )
+                except Exception as ex:
+                    # Expansion is best effort, the IDs are left as they are.
+                    self.logger.warning("Expanding from %s failed with error %s", service_name, repr(ex))
+                    continue
+
+                if isinstance(objects, dict) and rpc_errors.ERRORS_KEY in objects:
+                    self.logger.warning(
+                        "Expanding from %s failed with errors %s", service_name, objects[rpc_errors.ERRORS_KEY]
+                    )
+                    continue
+
+                for pk, obj in (objects or {}).get("results", {}).items():
+                    cache[(service_name, pk)] = obj
+
+        def expand_value(service_name, pk):
+            return cache.get((service_name, str(pk)), pk) if isinstance(pk, (str, int)) else pk
+
+        for field in expand:
+            service_name = self.expand_fields[field]
+
+            for row in rows:
+                if not isinstance(row, dict) or field not in row:
+                    continue
+
+                if isinstance(row[field], list):
+                    row[field] = [expand_value(service_name, pk) for pk in row[field]]
+                else:
+                    row[field] = expand_value(service_name, row[field])
+
+        return resp
+
+    def _call_read_method(self, request, method_name, **kwargs):
+        """
+        Call an idempotent service method, expanding the requested relations of its response,
+        and coalescing identical concurrent calls if enabled
+        """
+        service_name = self.get_rpc_service_name()
+        auth_kwargs = self._get_auth_kwargs(request)
+        expand = self.get_expand(kwargs)
+
+        def call():
+            resp = self.call_service_method(service_name, method_name, False, **{**auth_kwargs, **kwargs})
+
+            return self.expand_relations(request, auth_kwargs, resp, expand)
+
+        if not self.coalesce_reads:
+            return call()
+
+        key = (
+            service_name,
+            method_name,
+            json.dumps(kwargs, sort_keys=True, default=str),
+            ",".join(expand),
+            self.get_coalesce_auth_key(request),
+        )
+        # Followers wait no longer than their own request's deadline for the leader.
+        return single_flight.do(key, call, remaining_time())
 
     def get_rpc_service_name(self):
         assert self.rpc_service_name is not None, (
@@ -42,54 +221,50 @@ class HttpRpcViewset(viewsets.ViewSet, DjangoRpcWithCidMixin):
     @list_route(methods=["get"], url_path="search")
     @rpc_http_error_marshaller
     def search(self, request, *args, **kwargs):
-        jwt = self._getJwt(request)
         params = querydict_to_dict(request.query_params)
 
-        return self.call_service_method(
-            self.get_rpc_service_name(),
-            "search",
-            False,
-            **{**{"jwt": jwt}, **params},
-        )
+        return self._call_read_method(request, "search", **params)
+
+    @list_route(methods=["get"], url_path="changes")
+    @rpc_http_error_marshaller
+    def changes(self, request, *args, **kwargs):
+        params = querydict_to_dict(request.query_params)
+
+        return self._call_read_method(request, "changes", **params)
+
+    @list_route(methods=["get"], url_path="aggregate")
+    @rpc_http_error_marshaller
+    def aggregate(self, request, *args, **kwargs):
+        params = querydict_to_dict(request.query_params)
+
+        return self._call_read_method(request, "aggregate", **params)
 
     @rpc_http_error_marshaller
     def list(self, request, *args, **kwargs):
-        jwt = self._getJwt(request)
         params = querydict_to_dict(request.query_params)
 
-        return self.call_service_method(
-            self.get_rpc_service_name(),
-            "list",
-            False,
-            **{**{"jwt": jwt}, **params},
-        )
+        return self._call_read_method(request, "list", **params)
 
     @rpc_http_error_marshaller
     def retrieve(self, request, pk, *args, **kwargs):
-        jwt = self._getJwt(request)
         params = querydict_to_dict(request.query_params)
 
-        return self.call_service_method(
-            self.get_rpc_service_name(),
-            "retrieve",
-            False,
-            **{**{"jwt": jwt}, **{"pk": pk}, **params},
-        )
+        return self._call_read_method(request, "retrieve", **{**{"pk": pk}, **params})
 
     @rpc_http_error_marshaller
     def create(self, request, *args, **kwargs):
-        jwt = self._getJwt(request)
+        auth_kwargs = self._get_auth_kwargs(request)
 
         return self.call_service_method(
             self.get_rpc_service_name(),
             "create",
             False,
-            **{**{"jwt": jwt}, **request.data}
+            **{**auth_kwargs, **request.data}
         )
 
     @rpc_http_error_marshaller
     def update(self, request, pk, *args, **kwargs):
-        jwt = self._getJwt(request)
+        auth_kwargs = self._get_auth_kwargs(request)
         request_data = request.data
         request_data["partial"] = kwargs.pop("partial", False)
 
@@ -97,19 +272,19 @@ class HttpRpcViewset(viewsets.ViewSet, DjangoRpcWithCidMixin):
             self.get_rpc_service_name(),
             "update",
             False,
-            **{**{"jwt": jwt}, **{"pk": pk}, **request_data}
+            **{**auth_kwargs, **{"pk": pk}, **request_data}
         )
 
     @rpc_http_error_marshaller
     def delete(self, request, pk, *args, **kwargs):
-        jwt = self._getJwt(request)
+        auth_kwargs = self._get_auth_kwargs(request)
         request_data = request.data
 
         return self.call_service_method(
             self.get_rpc_service_name(),
             "delete",
             False,
-            **{**{"jwt": jwt}, **{"pk": pk}, **request_data}
+            **{**auth_kwargs, **{"pk": pk}, **request_data}
         )
 
     def partial_update(self, request, pk, *args, **kwargs):
@@ -1,13 +1,23 @@
 #pylint:disable=W0622
 """ Decorator for Nameko RPC """
 import logging
+import math
+import time
+
+from django.conf import settings
+from django.http import JsonResponse
 
 from rest_framework.response import Response
 from rest_framework import status
 
-from nameko.exceptions import RpcConnectionError, RpcTimeout, RemoteError
+from nameko.exceptions import RpcTimeout, RemoteError
 
 from ..rpc import rpc_errors
+from ..rpc.circuit_breaker import CircuitOpenError, RpcConnectionError
+from ..rpc.deadline import DeadlineExceeded, set_deadline
+from ..rpc.profiling import call_profiled, request_profile_from_header, set_profile_requested
+from ..rpc.rpc_connection_pool import RpcPoolExhausted
+from ..tracing.tracer import SERVER, trace_span
 
 
 def __handle_rpc_error(resp):
@@ -21,43 +31,146 @@ def __handle_rpc_error(resp):
         status_code = status.HTTP_403_FORBIDDEN
     elif rpc_errors.MISSING_SEARCH_PARAM_KEY in resp[rpc_errors.ERRORS_KEY]:
         status_code = status.HTTP_400_BAD_REQUEST
+    elif rpc_errors.INVALID_WATERMARK_KEY in resp[rpc_errors.ERRORS_KEY]:
+        status_code = status.HTTP_400_BAD_REQUEST
+    elif rpc_errors.SEARCH_TOO_EXPENSIVE_KEY in resp[rpc_errors.ERRORS_KEY]:
+        status_code = status.HTTP_400_BAD_REQUEST
+    elif rpc_errors.INVALID_AGGREGATE_KEY in resp[rpc_errors.ERRORS_KEY]:
+        status_code = status.HTTP_400_BAD_REQUEST
+    elif rpc_errors.TOO_MANY_IDS_KEY in resp[rpc_errors.ERRORS_KEY]:
+        status_code = status.HTTP_400_BAD_REQUEST
+    elif rpc_errors.QUERY_TIMEOUT_KEY in resp[rpc_errors.ERRORS_KEY]:
+        status_code = status.HTTP_504_GATEWAY_TIMEOUT
+    elif rpc_errors.DEADLINE_EXCEEDED_KEY in resp[rpc_errors.ERRORS_KEY]:
+        status_code = status.HTTP_504_GATEWAY_TIMEOUT
 
     return status_code
 
+def get_rpc_response_status(function_name, resp):
+    """ HTTP status code for an RPC response """
+    status_code = status.HTTP_201_CREATED if function_name == "create" else status.HTTP_200_OK
+
+    if resp is not None:
+        if rpc_errors.ERRORS_KEY in resp.keys():
+            status_code = __handle_rpc_error(resp)
+
+        if rpc_errors.VALIDATION_ERRORS_KEY in resp.keys():
+            status_code = status.HTTP_400_BAD_REQUEST
+
+    return status_code
+
+def get_rpc_exception_status(ex, logger):
+    """ HTTP status code and headers for an exception raised by an RPC call """
+    if isinstance(ex, CircuitOpenError):
+        logger.warning("Failing fast, %s", str(ex))
+        return status.HTTP_503_SERVICE_UNAVAILABLE, {"Retry-After": str(int(math.ceil(ex.retry_after)))}
+
+    if isinstance(ex, DeadlineExceeded):
+        logger.warning("Giving up, %s", str(ex))
+        return status.HTTP_504_GATEWAY_TIMEOUT, None
+
+    if isinstance(ex, RemoteError):
+        logger.error("Remote function call failed with error %s", getattr(ex, 'message', repr(ex)))
+        return status.HTTP_500_INTERNAL_SERVER_ERROR, None
+
+    if isinstance(ex, (RpcConnectionError, RpcTimeout, RpcPoolExhausted, OSError)):
+        logger.error("Wrapped function call failed with error %s", getattr(ex, 'message', repr(ex)))
+        return status.HTTP_503_SERVICE_UNAVAILABLE, None
+
+    logger.error("Unexpected error => %s", repr(ex))
+    return status.HTTP_500_INTERNAL_SERVER_ERROR, None
+
 def rpc_http_error_marshaller(function):
     """ Wrap HttpRpcViewset methods to handle RPC errors and return appropriate HTTP response codes.
 
         Methods like: list, retrieve, update, create, and delete, which require potentially handling
         RPC errors and translating those into HTTP status codes.
+
+        Each request gets a deadline of RPC_DEADLINE TIMEOUT seconds, passed on to the services it calls,
+        and is the root span of its trace when TRACING is configured. Requests can be profiled on demand,
+        see `rpc.profiling`.
     """
 
     def wrapper(self, *args, **kwargs):
         """ Call wrapped function """
         logger = logging.getLogger(__name__)
+        timeout = getattr(settings, "RPC_DEADLINE", {}).get("TIMEOUT")
+
+        with trace_span("{0}.{1}".format(type(self).__name__, function.__name__), SERVER) as span:
+            try:
+                set_deadline(time.time() + timeout if timeout else None)
+                request_profile_from_header(args[0] if args else kwargs["request"])
+                resp = call_profiled(
+                    "gateway.{0}.{1}".format(type(self).__name__, function.__name__),
+                    function,
+                    self,
+                    *args,
+                    **kwargs
+                )
+                status_code = get_rpc_response_status(function.__name__, resp)
+
+                logger.debug("Response: %s", repr(resp))
+
+                response = Response(resp, status=status_code)
+
+            except Exception as ex:
+                status_code, headers = get_rpc_exception_status(ex, logger)
+                response = Response(None, status=status_code, headers=headers)
+
+            finally:
+                set_deadline(None)
+                set_profile_requested(False)
+
+            if span is not None:
+                span.set_attribute("http.status_code", status_code)
+
+                if status_code >= 500:
+                    span.error = "HTTP {0}".format(status_code)
+
+            return response
+
+    return wrapper
+
+def async_rpc_http_error_marshaller(function):
+    """
+    Same as rpc_http_error_marshaller, for the coroutine methods of AsyncHttpRpcViewset. The deadline,
+    trace and profile flag are context variables, so each request's task keeps its own. Profiling
+    only propagates the flag, the view itself isn't profiled.
+    """
+
+    async def wrapper(self, *args, **kwargs):
+        """ Await wrapped function """
+        logger = logging.getLogger(__name__)
+        timeout = getattr(settings, "RPC_DEADLINE", {}).get("TIMEOUT")
+
+        with trace_span("{0}.{1}".format(type(self).__name__, function.__name__), SERVER) as span:
+            try:
+                set_deadline(time.time() + timeout if timeout else None)
+                request_profile_from_header(args[0] if args else kwargs["request"])
+                resp = await function(self, *args, **kwargs)
+                status_code = get_rpc_response_status(function.__name__, resp)
+
+                logger.debug("Response: %s", repr(resp))
+
+                response = JsonResponse(resp, status=status_code, safe=False)
 
-        try:
-            status_code = status.HTTP_201_CREATED if function.__name__ == "create" else status.HTTP_200_OK
-            resp = function(self, *args, **kwargs)
+            except Exception as ex:
+                status_code, headers = get_rpc_exception_status(ex, logger)
+                response = JsonResponse(None, status=status_code, safe=False)
 
-            if resp is not None:
-                if rpc_errors.ERRORS_KEY in resp.keys():
-                    status_code = __handle_rpc_error(resp)
+                for header, value in (headers or {}).items():
+                    response[header] = value
 
-                if rpc_errors.VALIDATION_ERRORS_KEY in resp.keys():
-                    status_code = status.HTTP_400_BAD_REQUEST
+            finally:
+                set_deadline(None)
+                set_profile_requested(False)
 
-            logger.debug("Response: %s", repr(resp))
+            if span is not None:
+                span.set_attribute("http.status_code", status_code)
 
-            return Response(resp, status=status_code)
+                if status_code >= 500:
+                    span.error = "HTTP {0}".format(status_code)
 
-        except (RemoteError) as ex:
-            logger.error("Remote function call failed with error %s", getattr(ex, 'message', repr(ex)))
-            return Response(None, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        except (RpcConnectionError, RpcTimeout, OSError) as ex:
-            logger.error("Wrapped function call failed with error %s", getattr(ex, 'message', repr(ex)))
-            return Response(None, status=status.HTTP_503_SERVICE_UNAVAILABLE)
-        except Exception as ex:
-            logger.error("Unexpected error => %s", repr(ex))
-            return Response(None, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return response
 
     return wrapper
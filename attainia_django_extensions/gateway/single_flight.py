@@ -0,0 +1,81 @@
+""" Single-flight coalescing of identical concurrent calls """
+import copy
+import threading
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight(object):
+    """
+    Concurrent calls with the same key share a single execution of the function; the first caller
+    runs it and every caller that arrived while it was in flight gets a copy of its result or error.
+
+    A follower waits for the leader at most `timeout` seconds (its own deadline), or `follower_timeout`
+    without one, then makes the call itself rather than stall along with the leader.
+    """
+
+    def __init__(self, follower_timeout: float = 30):
+        self.follower_timeout = follower_timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._coalesced = 0
+        self._timeouts = 0
+
+    def do(self, key, function, timeout: float = None):
+        with self._lock:
+            self._requests += 1
+            call = self._calls.get(key)
+            leader = call is None
+
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self._coalesced += 1
+                call.followers += 1
+
+        if not leader:
+            if not call.done.wait(self.follower_timeout if timeout is None else max(0.0, timeout)):
+                with self._lock:
+                    self._timeouts += 1
+
+                return function()
+
+            if call.error is not None:
+                raise call.error
+
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = function()
+        except Exception as ex:
+            call.error = ex
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+            call.done.set()
+
+        # Followers copy the shared result, so the leader needs its own copy too if it has any.
+        return copy.deepcopy(call.result) if call.followers else call.result
+
+    def stats(self):
+        """ Number of calls, how many of them were coalesced, the coalesce ratio and follower timeouts """
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "coalesced": self._coalesced,
+                "timeouts": self._timeouts,
+                "coalesce_ratio": self._coalesced / self._requests if self._requests else 0.0,
+            }
+
+
+# Shared by every gateway viewset in the process.
+single_flight = SingleFlight()
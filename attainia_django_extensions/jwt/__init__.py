@@ -1,3 +1,18 @@
 """ Django JWT Authorization and Authentication """
-from .jwt_authentication import JwtAuthentication
-from .jwt_scope_permissions import JwtScopePermission
+import importlib
+
+
+# The classes are imported on first use, so importing the package doesn't pull in DRF.
+_exports = {
+    "JwtAuthentication": ".jwt_authentication",
+    "JwtScopePermission": ".jwt_scope_permissions",
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    if name in _exports:
+        return getattr(importlib.import_module(_exports[name], __name__), name)
+
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
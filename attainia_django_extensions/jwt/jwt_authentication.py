@@ -6,7 +6,7 @@ from django.conf import settings
 from rest_framework import authentication, exceptions
 from rest_framework.authentication import get_authorization_header
 
-from ..rpc.rpc_mixin import RpcMixin
+from ..rpc.django_rpc_with_cid_mixin import DjangoRpcWithCidMixin
 
 
 """
@@ -33,11 +33,18 @@ from ..rpc.rpc_mixin import RpcMixin
         }
 
 """
-class JwtAuthentication(authentication.BaseAuthentication, RpcMixin):
+class JwtAuthentication(authentication.BaseAuthentication, DjangoRpcWithCidMixin):
     """ JWT Authentication Class """
     logger = logging.getLogger(__name__)
-    auth_service_name = settings.AUTH_SERVICE_NAME
-    validate_token_method = settings.VALIDATE_TOKEN_METHOD
+
+    # Read from the settings on first use rather than at import, subclasses may override them with attributes.
+    @property
+    def auth_service_name(self):
+        return settings.AUTH_SERVICE_NAME
+
+    @property
+    def validate_token_method(self):
+        return settings.VALIDATE_TOKEN_METHOD
 
     def authenticate(self, request):
         self.logger.debug("JWTAuthentication.authenticate")
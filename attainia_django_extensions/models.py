@@ -1,12 +1,111 @@
 from django.db import models
+from django.utils import timezone
+
+from .audit import get_audit_user
+
+
+class AuditTrailQuerySet(models.QuerySet):
+    """
+    Stamps bulk writes with the audit user and time, which Django leaves out because they don't
+    go through `save()`.
+    """
+
+    def _stamp(self, obj, now, user, created):
+        if created and obj.created_by is None:
+            obj.created_by = user
+
+        obj.modified_by = user if user is not None else obj.modified_by
+        obj.modified_at = now
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        now = timezone.now()
+        user = get_audit_user()
+
+        for obj in objs:
+            self._stamp(obj, now, user, created=True)
+
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        now = timezone.now()
+        user = get_audit_user()
+        fields = list(fields)
+
+        for obj in objs:
+            self._stamp(obj, now, user, created=False)
+
+        for audit_field in ("modified_at", "modified_by"):
+            if audit_field not in fields:
+                fields.append(audit_field)
+
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+    def update(self, **kwargs):
+        kwargs.setdefault("modified_at", timezone.now())
+        user = get_audit_user()
+
+        if user is not None:
+            kwargs.setdefault("modified_by", user)
+
+        return super().update(**kwargs)
 
 
 class AuditTrailModel(models.Model):
+    """ Audit fields stamped with the audit user set for the current call, see `set_audit_user` """
     created_at = models.DateTimeField(auto_now_add=True)
     modified_at = models.DateTimeField(auto_now=True)
     created_by = models.UUIDField(blank=True, null=True)
     modified_by = models.UUIDField(blank=True, null=True)
 
+    objects = models.Manager.from_queryset(AuditTrailQuerySet)()
+
     class Meta:
         abstract = True
         get_latest_by = "modified_at"
+
+    def save(self, *args, **kwargs):
+        user = get_audit_user()
+
+        if user is not None:
+            if self._state.adding and self.created_by is None:
+                self.created_by = user
+
+            self.modified_by = user
+
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def modified_at_index(name, pk_field="id"):
+        """
+        Index matching the (modified_at, pk) ordering of DjangoDataAccess.changes, for the concrete model's Meta.
+
+            class Meta:
+                indexes = [AuditTrailModel.modified_at_index("asset_modified_at_idx")]
+
+        """
+        return models.Index(fields=["modified_at", pk_field], name=name)
+
+
+class TombstoneModel(models.Model):
+    """ Records deleted objects so DjangoDataAccess.changes can report them to delta-sync clients """
+    model_label = models.CharField(max_length=100)
+    object_id = models.CharField(max_length=64)
+    deleted_at = models.DateTimeField(auto_now_add=True)
+    deleted_by = models.UUIDField(blank=True, null=True)
+
+    class Meta:
+        abstract = True
+        get_latest_by = "deleted_at"
+
+    @staticmethod
+    def deleted_at_index(name):
+        """
+        Index matching the (deleted_at, pk) ordering of DjangoDataAccess.changes, for the concrete model's Meta.
+
+            class Meta:
+                indexes = [TombstoneModel.deleted_at_index("tombstone_deleted_at_idx")]
+
+        """
+        return models.Index(fields=["model_label", "deleted_at", "id"], name=name)
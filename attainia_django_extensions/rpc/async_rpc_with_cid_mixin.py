@@ -0,0 +1,63 @@
+#pylint:disable=W0622
+""" Async RPC Abstraction Wrapper """
+import asyncio
+import logging
+from uuid import uuid4
+
+from cid import locals
+
+from .async_rpc_client import get_async_rpc_client
+from .circuit_breaker import get_circuit_breaker
+from .claim_check import fetch_payload, is_claim_check
+from .deadline import propagate_deadline
+from .profiling import propagate_profile
+from ..tracing.tracer import propagate_trace
+
+
+"""
+A mixin class for making RPC calls from coroutines.
+"""
+class AsyncRpcWithCidMixin(object):
+    """
+    Example usage:
+
+        MyClass(AsyncRpcWithCidMixin):
+            ...
+
+            # Make service RPC
+            await self.call_service_method("auth_service", "validate_token", token)
+
+
+    Requires the ASYNC_RPC_CLIENT setting, see `async_rpc_client`. Calls go through the same
+    per-service circuit breakers as DjangoRpcWithCidMixin.
+
+    """
+    logger = logging.getLogger(__name__)
+
+    def _get_rpc_client(self):
+        return get_async_rpc_client()
+
+    async def call_service_method(self, service_name: str, method_name: str, *args, **kwargs):
+        """ Call an RPC method from a service """
+        self.logger.debug("Calling service: %s, method: %s", service_name, method_name)
+
+        try:
+            # Get the correlation ID if it exists, otherwise create one
+            cid = locals.get_cid() or str(uuid4())
+            new_kwargs = {**kwargs, **{"cid": cid}}
+            propagate_trace(new_kwargs)
+            propagate_profile(new_kwargs)
+            propagate_deadline(new_kwargs)
+
+            with get_circuit_breaker(service_name).guard():
+                result = await self._get_rpc_client().call(service_name, method_name, *args, **new_kwargs)
+
+            if is_claim_check(result):
+                # Reading the blob is blocking IO, keep it off the event loop.
+                result = await asyncio.get_event_loop().run_in_executor(None, fetch_payload, result)
+
+            return result
+
+        except Exception as ex:
+            self.logger.error("RPC call failed with error %s", getattr(ex, 'message', repr(ex)))
+            raise ex
@@ -0,0 +1,143 @@
+""" Per-service circuit breaker for RPC calls """
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from nameko import exceptions as nameko_exceptions
+from nameko.exceptions import RpcTimeout
+
+
+# Nameko 2.7 dropped RpcConnectionError, failed connections raise the socket's ConnectionError since.
+RpcConnectionError = getattr(nameko_exceptions, "RpcConnectionError", ConnectionError)
+
+
+class CircuitOpenError(Exception):
+    """ Raised when an RPC call is rejected because the service's circuit is open """
+
+    def __init__(self, service_name: str, retry_after: float):
+        super().__init__("Circuit open for service: {0}".format(service_name))
+        self.service_name = service_name
+        self.retry_after = retry_after
+
+
+def is_transport_failure(ex: Exception) -> bool:
+    """ Only failures to reach or hear back from a service count against its circuit """
+    return isinstance(ex, (RpcConnectionError, RpcTimeout, OSError))
+
+
+class CircuitBreaker(object):
+    """
+    Tracks consecutive transport failures for a single service.
+
+        closed    -> open       after `failure_threshold` consecutive failures
+        open      -> half open  after `reset_timeout` seconds, letting one trial call through
+        half open -> closed     when the trial call succeeds, back to open when it fails
+
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, service_name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.service_name = service_name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """ Raise CircuitOpenError if the call should not be attempted """
+        with self._lock:
+            if self.state == self.OPEN:
+                elapsed = time.monotonic() - self.opened_at
+
+                if elapsed < self.reset_timeout:
+                    raise CircuitOpenError(self.service_name, self.reset_timeout - elapsed)
+
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+
+            if self.state == self.HALF_OPEN:
+                if self._trial_in_flight:
+                    raise CircuitOpenError(self.service_name, self.reset_timeout)
+
+                self._trial_in_flight = True
+
+    @contextmanager
+    def guard(self):
+        """
+        before_call, then settle the call however the block ends. Only transport failures count
+        against the circuit, any other error means the service answered.
+        """
+        self.before_call()
+
+        try:
+            yield
+        except Exception as ex:
+            if is_transport_failure(ex):
+                self.record_failure()
+            else:
+                self.record_success()
+            raise
+        except BaseException:
+            # Cancelled, the outcome is unknown, let the next call be the trial.
+            self.release_trial()
+            raise
+        else:
+            self.record_success()
+
+    def release_trial(self):
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                self.logger.info("Circuit closed for service: %s", self.service_name)
+
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.logger.warning("Circuit opened for service: %s", self.service_name)
+
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(service_name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+    """ Get the process wide circuit breaker for a service, creating it on first use """
+    breaker = _breakers.get(service_name)
+
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(
+                service_name,
+                CircuitBreaker(service_name, failure_threshold, reset_timeout)
+            )
+
+    return breaker
+
+
+def get_circuit_state(service_name: str) -> str:
+    """ The current state of a service's circuit, without creating a breaker for it """
+    breaker = _breakers.get(service_name)
+
+    return breaker.state if breaker is not None else CircuitBreaker.CLOSED
@@ -0,0 +1,259 @@
+"""
+Claim-check offloading for oversized RPC results and event payloads.
+
+    Payloads whose JSON is larger than THRESHOLD bytes are written to a blob store shared by the
+    services, and only a reference with a checksum travels through the broker. The RPC caller or the
+    event handler fetches the payload back on receipt. Blobs are left for every receiver to fetch and
+    purged once they are older than TTL seconds.
+
+        CLAIM_CHECK = {
+            "THRESHOLD": 256 * 1024,
+            "STORE": "attainia_django_extensions.rpc.claim_check.FileSystemBlobStore",
+            "OPTIONS": {"path": "/mnt/shared/claim-check"},
+            "TTL": 3600,
+        }
+
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from uuid import UUID, uuid4
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.module_loading import import_string
+
+
+CLAIM_CHECK_KEY = "__claim_check__"
+
+
+class ClaimCheckError(Exception):
+    """ Raised when a claim-checked payload is missing or doesn't match its checksum """
+    pass
+
+
+def validate_key(key) -> str:
+    """ Keys come off the message, only accept the UUIDs check_in makes """
+    try:
+        if str(UUID(key)) == key:
+            return key
+    except (TypeError, ValueError, AttributeError):
+        pass
+
+    raise ClaimCheckError("Invalid claim-check key: {0!r}".format(key))
+
+
+class BlobStore(object):
+    """ Interface for claim-check blob stores """
+
+    def put(self, key: str, data: bytes):
+        raise NotImplementedError()
+
+    def get(self, key: str) -> bytes:
+        raise NotImplementedError()
+
+    def purge_expired(self, ttl: float):
+        raise NotImplementedError()
+
+
+class FileSystemBlobStore(BlobStore):
+    """ Blobs as files in a local directory or shared volume """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _blob_path(self, key):
+        return os.path.join(self.path, validate_key(key))
+
+    def put(self, key, data):
+        blob_path = self._blob_path(key)
+        temp_path = "{0}.tmp".format(blob_path)
+
+        # Write then rename, so a reader never sees a partial blob.
+        with open(temp_path, "wb") as blob:
+            blob.write(data)
+
+        os.replace(temp_path, blob_path)
+
+    def get(self, key):
+        try:
+            with open(self._blob_path(key), "rb") as blob:
+                return blob.read()
+        except FileNotFoundError:
+            raise ClaimCheckError("Claim-checked payload not found: {0}".format(key))
+
+    def purge_expired(self, ttl):
+        expires_before = time.time() - ttl
+
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file() and entry.stat().st_mtime < expires_before:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+
+class InMemoryBlobStore(BlobStore):
+    """ Process local stand-in for tests """
+
+    def __init__(self):
+        self.blobs = {}
+
+    def put(self, key, data):
+        self.blobs[key] = (time.time(), data)
+
+    def get(self, key):
+        try:
+            return self.blobs[key][1]
+        except KeyError:
+            raise ClaimCheckError("Claim-checked payload not found: {0}".format(key))
+
+    def purge_expired(self, ttl):
+        expires_before = time.time() - ttl
+
+        for key, (stored_at, _) in list(self.blobs.items()):
+            if stored_at < expires_before:
+                self.blobs.pop(key, None)
+
+
+def is_claim_check(payload) -> bool:
+    return isinstance(payload, dict) and CLAIM_CHECK_KEY in payload
+
+
+class ClaimCheck(object):
+    """ Swaps oversized payloads for references to a blob store and back """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, store: BlobStore, threshold: int = 256 * 1024, ttl: float = 3600, purge_interval: float = 60):
+        self.store = store
+        self.threshold = threshold
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._purged_at = time.monotonic()
+        self._purge_lock = threading.Lock()
+
+    def _purge_if_due(self):
+        now = time.monotonic()
+
+        if now - self._purged_at < self.purge_interval or not self._purge_lock.acquire(blocking=False):
+            return
+
+        try:
+            self._purged_at = now
+            self.store.purge_expired(self.ttl)
+        except Exception as ex:
+            self.logger.warning("Purging expired claim-checked payloads failed with error %s", repr(ex))
+        finally:
+            self._purge_lock.release()
+
+    def check_in(self, payload):
+        """ The payload itself if it's small enough, otherwise a reference to it in the blob store """
+        data = json.dumps(payload, cls=DjangoJSONEncoder).encode("utf-8")
+
+        if len(data) <= self.threshold:
+            return payload
+
+        key = str(uuid4())
+        self.store.put(key, data)
+        self._purge_if_due()
+
+        self.logger.debug("Claim-checked payload of %s bytes as %s", len(data), key)
+
+        return {
+            CLAIM_CHECK_KEY: {
+                "key": key,
+                "sha256": hashlib.sha256(data).hexdigest(),
+                "size": len(data),
+            }
+        }
+
+    def check_out(self, payload):
+        """ The original payload for a reference, any other payload is returned as is """
+        if not is_claim_check(payload):
+            return payload
+
+        reference = payload[CLAIM_CHECK_KEY]
+
+        if not isinstance(reference, dict):
+            raise ClaimCheckError("Invalid claim-check reference")
+
+        data = self.store.get(validate_key(reference.get("key")))
+
+        if hashlib.sha256(data).hexdigest() != reference["sha256"]:
+            raise ClaimCheckError("Claim-checked payload checksum mismatch: {0}".format(reference["key"]))
+
+        return json.loads(data.decode("utf-8"))
+
+
+_claim_check = None
+_claim_check_lock = threading.Lock()
+
+
+def get_claim_check():
+    """ Process wide ClaimCheck built from the CLAIM_CHECK setting, or None if it isn't configured """
+    global _claim_check
+
+    try:
+        claim_check_settings = getattr(settings, "CLAIM_CHECK", None)
+    except ImproperlyConfigured:
+        # A Nameko service that isn't hosting Django.
+        return None
+
+    if not claim_check_settings:
+        return None
+
+    if _claim_check is None:
+        with _claim_check_lock:
+            if _claim_check is None:
+                store_class = import_string(
+                    claim_check_settings.get("STORE", "attainia_django_extensions.rpc.claim_check.FileSystemBlobStore")
+                )
+                _claim_check = ClaimCheck(
+                    store_class(**claim_check_settings.get("OPTIONS", {})),
+                    threshold=claim_check_settings.get("THRESHOLD", 256 * 1024),
+                    ttl=claim_check_settings.get("TTL", 3600),
+                )
+
+    return _claim_check
+
+
+def offload_payload(payload):
+    """ Claim-check the payload if it's too large and CLAIM_CHECK is configured """
+    claim_check = get_claim_check()
+
+    if claim_check is None:
+        return payload
+
+    return claim_check.check_in(payload)
+
+
+class ClaimCheckedReply(object):
+    """ Wraps the reply of an async RPC so its result is fetched if it was claim-checked """
+
+    def __init__(self, reply):
+        self.reply = reply
+
+    def result(self):
+        return fetch_payload(self.reply.result())
+
+    def __getattr__(self, name):
+        return getattr(self.reply, name)
+
+
+def fetch_payload(payload):
+    """ Fetch a claim-checked payload, any other payload is returned as is """
+    if not is_claim_check(payload):
+        return payload
+
+    claim_check = get_claim_check()
+
+    if claim_check is None:
+        raise ClaimCheckError("Received a claim-checked payload but CLAIM_CHECK isn't configured")
+
+    return claim_check.check_out(payload)
@@ -0,0 +1,194 @@
+"""
+Pooled database connections for Django ORM calls made by Nameko workers.
+
+    Django keeps a connection per thread, and under eventlet every Nameko worker greenthread is a
+    new "thread", so each worker opens a connection of its own that nothing ever closes. With the
+    pool, the connections a worker used are handed back in `worker_teardown` and reused by the
+    next worker, and at most MAX_CONNECTIONS workers use the database at once (the others wait
+    their turn), however large max_workers is.
+
+    Connections are recycled the way Django would: after an error that left them unusable, or
+    once they are older than the database's CONN_MAX_AGE, so set CONN_MAX_AGE (e.g. 300) on the
+    pooled databases, a warning is logged at startup for those without it. Idle connections are
+    checked with a round trip before being reused.
+
+    Every alias in DATABASES is pooled, read replicas included, unless the setting lists them.
+
+        DB_CONNECTION_POOL = {
+            "DATABASES": ["default", "replica"],
+            "MAX_CONNECTIONS": 10,
+            "HEALTH_CHECK_AFTER": 30,
+        }
+
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+
+class DbConnectionPool(object):
+    """ Idle raw connections per database alias, and the limit on workers using them """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, aliases, max_connections: int = 10, health_check_after: float = 30):
+        self.aliases = list(aliases)
+        self.max_connections = max_connections
+        self.health_check_after = health_check_after
+        # Green when Nameko has monkey patched threading, so waiting workers yield to the others.
+        self._semaphore = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+        # alias -> [(raw connection, close at, returned at)]
+        self._idle = {alias: [] for alias in self.aliases}
+
+        for alias in self.aliases:
+            if not connections.databases[alias].get("CONN_MAX_AGE", 0):
+                self.logger.warning(
+                    "The %s database has CONN_MAX_AGE 0, its pooled connections are closed after every worker", alias
+                )
+
+    def acquire(self):
+        """ Wait for a turn, then attach idle connections to this worker's Django connections """
+        self._semaphore.acquire()
+
+        try:
+            for alias in self.aliases:
+                self._attach(alias)
+        except Exception:
+            self.release()
+            raise
+
+    def release(self):
+        """ Detach this worker's connections and return the reusable ones to the pool """
+        try:
+            for alias in self.aliases:
+                try:
+                    self._detach(alias)
+                except Exception as ex:
+                    self.logger.warning("Returning the %s connection failed with error %s", alias, repr(ex))
+        finally:
+            self._semaphore.release()
+
+    def _attach(self, alias):
+        wrapper = connections[alias]
+
+        while wrapper.connection is None:
+            with self._lock:
+                if not self._idle[alias]:
+                    # Django connects on the first query, as it normally would.
+                    return
+
+                raw_connection, close_at, returned_at = self._idle[alias].pop()
+
+            wrapper.connection = raw_connection
+            wrapper.close_at = close_at
+            self._reset_transaction_state(wrapper)
+
+            if time.monotonic() - returned_at > self.health_check_after and not wrapper.is_usable():
+                self.logger.info("Discarding a stale %s connection", alias)
+                wrapper.close()
+
+    def _reset_transaction_state(self, wrapper):
+        """
+        A new DatabaseWrapper starts out as Django leaves one before connecting, autocommit off
+        among the rest. The pool only keeps connections that were returned outside any transaction,
+        in the database's AUTOCOMMIT mode, so that is the state to give the wrapper.
+        """
+        wrapper.autocommit = wrapper.settings_dict["AUTOCOMMIT"]
+        wrapper.in_atomic_block = False
+        wrapper.savepoint_ids = []
+        wrapper.savepoint_state = 0
+        wrapper.commit_on_exit = True
+        wrapper.needs_rollback = False
+        wrapper.closed_in_transaction = False
+        wrapper.errors_occurred = False
+        wrapper.run_on_commit = []
+
+    def _detach(self, alias):
+        wrapper = connections[alias]
+
+        if wrapper.connection is None:
+            return
+
+        if wrapper.in_atomic_block or wrapper.get_autocommit() != wrapper.settings_dict["AUTOCOMMIT"]:
+            # Left mid-transaction, it can't be handed to another worker.
+            wrapper.close()
+            return
+
+        if not wrapper.get_autocommit():
+            # Without AUTOCOMMIT a transaction is always open, end it as closing the connection would.
+            wrapper.rollback()
+
+        # Closes connections that errored and are unusable, or are past CONN_MAX_AGE.
+        wrapper.close_if_unusable_or_obsolete()
+
+        if wrapper.connection is None:
+            return
+
+        raw_connection = wrapper.connection
+        wrapper.connection = None
+
+        with self._lock:
+            self._idle[alias].append((raw_connection, wrapper.close_at, time.monotonic()))
+
+    def stats(self):
+        with self._lock:
+            return {alias: len(idle) for alias, idle in self._idle.items()}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_db_connection_pool():
+    """ Process wide pool built from the DB_CONNECTION_POOL setting, or None if it isn't configured """
+    global _pool
+
+    pool_settings = getattr(settings, "DB_CONNECTION_POOL", None)
+
+    if not pool_settings:
+        return None
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = DbConnectionPool(
+                    pool_settings.get("DATABASES", list(settings.DATABASES)),
+                    max_connections=pool_settings.get("MAX_CONNECTIONS", 10),
+                    health_check_after=pool_settings.get("HEALTH_CHECK_AFTER", 30),
+                )
+
+    return _pool
+
+
+_local = threading.local()
+
+
+class PooledDbConnectionsMixin(object):
+    """
+    For Nameko dependency providers using the Django ORM. A worker with several such providers
+    takes a single turn in the pool.
+    """
+
+    def setup(self):
+        # Build the pool when the service starts, so configuration problems show up then.
+        get_db_connection_pool()
+        super().setup()
+
+    def worker_setup(self, worker_ctx):
+        pool = get_db_connection_pool()
+        depth = getattr(_local, "depth", 0)
+
+        if pool is not None and depth == 0:
+            pool.acquire()
+
+        _local.depth = depth + 1
+
+    def worker_teardown(self, worker_ctx):
+        pool = get_db_connection_pool()
+        _local.depth = max(0, getattr(_local, "depth", 1) - 1)
+
+        if pool is not None and _local.depth == 0:
+            pool.release()
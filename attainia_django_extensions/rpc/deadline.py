@@ -0,0 +1,95 @@
+"""
+Deadline propagation alongside the correlation ID.
+
+    The gateway gives each request an absolute deadline (epoch seconds) TIMEOUT seconds from when it
+    arrives. It travels with the CID as the `deadline` kwarg of every RPC, less HOP_MARGIN per hop
+    for the time the reply takes to get back, so it shrinks on its way downstream. A service that
+    receives an expired deadline answers with a `deadline_exceeded` error (504 at the gateway)
+    instead of doing work nobody will read.
+
+        RPC_DEADLINE = {
+            "TIMEOUT": 30,
+            "HOP_MARGIN": 0.05,
+        }
+
+    Nameko services read HOP_MARGIN from the same key in their config. Handlers can read the
+    deadline of the current call with `get_deadline()` or `remaining_time()`.
+
+"""
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from . import rpc_errors
+
+
+# A context variable rather than a thread local, so concurrent ASGI requests on the event loop
+# thread each keep their own. Threads and greenthreads start with a context of their own.
+_deadline = ContextVar("rpc_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """ Raised when work is about to start after the caller's deadline """
+    pass
+
+
+def set_deadline(deadline):
+    """ Set the absolute deadline of the current call, or clear it with None """
+    _deadline.set(deadline)
+
+
+def get_deadline():
+    """ The absolute deadline of the current call, or None if it has none """
+    return _deadline.get()
+
+
+def remaining_time():
+    """ Seconds left until the deadline, or None if the current call has none """
+    deadline = get_deadline()
+
+    return None if deadline is None else deadline - time.time()
+
+
+def is_expired() -> bool:
+    remaining = remaining_time()
+
+    return remaining is not None and remaining <= 0
+
+
+def check_deadline():
+    """ Raise DeadlineExceeded if the current call's deadline has passed """
+    if is_expired():
+        raise DeadlineExceeded("Deadline exceeded by {0:.3f} s".format(-remaining_time()))
+
+
+def propagate_deadline(kwargs: dict, hop_margin: float = 0.0):
+    """ Add the current deadline, less the hop margin, to the kwargs of an outgoing RPC """
+    deadline = get_deadline()
+
+    if deadline is not None:
+        check_deadline()
+        kwargs["deadline"] = deadline - hop_margin
+
+    return kwargs
+
+
+def deadline_exceeded_error():
+    return {rpc_errors.ERRORS_KEY: {rpc_errors.DEADLINE_EXCEEDED_KEY: rpc_errors.DEADLINE_EXCEEDED_VALUE}}
+
+
+def _check_deadline_before_query(execute, sql, params, many, context):
+    check_deadline()
+
+    return execute(sql, params, many, context)
+
+
+@contextmanager
+def abort_queries_after_deadline():
+    """ Raise DeadlineExceeded instead of running any further query once the deadline has passed """
+    from django.db import connections
+
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(_check_deadline_before_query))
+
+        yield
@@ -1,30 +1,41 @@
 """ Django data access Nameko dependency provider """
+import json
 import operator
 from collections import OrderedDict
 from functools import reduce
 
 from django.conf import settings
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import FieldDoesNotExist, ObjectDoesNotExist, ValidationError
 from django.core.paginator import Paginator
-from django.db.models import Q
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Avg, Count, Max, Min, Q, Sum
 from django.db.models.constants import LOOKUP_SEP
+from django.utils.dateparse import parse_datetime
 
 from nameko.extensions import DependencyProvider
 
 from . import rpc_errors
+from .db_connection_pool import PooledDbConnectionsMixin
+from .replica_router import ReadReplicaMixin
 from .rpc_view_adapter import RpcViewAdapter
+from .statement_timeout import statement_timeout
 
 
 def querydict_to_dict(querydict):
     return {k: v[0] if len(v) == 1 else v for k, v in querydict.lists()}
 
 
-class DjangoDataAccessProvider(DependencyProvider):
+class DjangoDataAccessProvider(PooledDbConnectionsMixin, DependencyProvider):
+    """ Workers share pooled database connections when DB_CONNECTION_POOL is configured, see `db_connection_pool` """
     queryset = None
     serializer_class = None
     search_fields = []
+    tombstone_model = None
+    aggregate_options = None
 
     def setup(self):
+        super().setup()
 
         if self.container.get_queryset:
             self.queryset = self.container.get_queryset()
@@ -43,14 +54,39 @@ class DjangoDataAccessProvider(DependencyProvider):
         if self.container.search_fields:
             self.search_fields
 
+        self.tombstone_model = getattr(self.container, "tombstone_model", None)
+        self.aggregate_options = getattr(self.container, "aggregate_options", None)
+
     def get_dependency(self, worker_ctx):
-        return DjangoDataAccess(self.queryset, self.serializer_class, self.search_fields)
+        return DjangoDataAccess(
+            self.queryset,
+            self.serializer_class,
+            self.search_fields,
+            worker_ctx,
+            tombstone_model=self.tombstone_model,
+            aggregate_options=self.aggregate_options,
+        )
 
 
-class DjangoDataAccess(RpcViewAdapter):
+class DjangoDataAccess(RpcViewAdapter, ReadReplicaMixin):
     """
     Provides common DRF ViewSet-like abstractions for interacting with models
     and serializers via RPC.
+
+    Reads go to a read replica when DATABASE_READ_REPLICAS is configured, see `replica_router`.
+
+    The `changes` delta-sync method expects an AuditTrailModel, and a concrete TombstoneModel
+    to report deletions.
+
+    The `aggregate` method only groups by, aggregates and filters on what the service allows:
+
+        aggregate_options = {
+            "GROUP_BY": ["status", "org"],
+            "AGGREGATES": {"id": ["count"], "amount": ["sum", "avg"]},
+            "FILTERS": ["status", "created_at__gte"],
+            "MAX_GROUPS": 1000,
+        }
+
     """
     lookup_field = "pk"
     lookup_kwarg = None
@@ -60,15 +96,27 @@ class DjangoDataAccess(RpcViewAdapter):
         "@": "search",
         "$": "iregex",
     }
+    aggregate_functions = {
+        "count": Count,
+        "sum": Sum,
+        "avg": Avg,
+        "min": Min,
+        "max": Max,
+    }
 
-    def __init__(self, queryset, serializer_class, search_fields):
+    def __init__(self, queryset, serializer_class, search_fields, worker_ctx=None, tombstone_model=None,
+                 aggregate_options=None):
+        super().__init__(worker_ctx)
         self.queryset = queryset
         self.serializer_class = serializer_class
         self.search_fields = search_fields
+        self.tombstone_model = tombstone_model
+        self.aggregate_options = aggregate_options or {}
 
     def get_object(self, **kwargs):
-        queryset = self.queryset
+        return self._lookup_object(self.queryset, kwargs)
 
+    def _lookup_object(self, queryset, kwargs):
         # Perform the lookup filtering.
         lookup_kwarg = self.lookup_kwarg or self.lookup_field
 
@@ -105,6 +153,184 @@ class DjangoDataAccess(RpcViewAdapter):
             })
         ])
 
+    def get_changed_fields(self, instance, validated_data):
+        """
+        Map of validated data keys to the model fields whose value differs from the instance, or None
+        when the update can't be narrowed down (custom serializer update, many-to-many or non-model fields).
+        """
+        from rest_framework.serializers import ModelSerializer
+
+        if getattr(self.serializer_class, "update", None) is not ModelSerializer.update:
+            return None
+
+        changed_fields = {}
+
+        for key, value in validated_data.items():
+            try:
+                field = instance._meta.get_field(key)
+            except FieldDoesNotExist:
+                return None
+
+            if field.many_to_many or not field.concrete:
+                return None
+
+            if field.is_relation and value is not None:
+                value = value.pk
+
+            if getattr(instance, field.attname) != value:
+                changed_fields[key] = field.name
+
+        return changed_fields
+
+    def perform_update(self, serializer, changed_fields):
+        """
+        Write the update, only called when something changed. Override to emit events after the write.
+        """
+        if changed_fields is None:
+            serializer.save()
+            return
+
+        instance = serializer.instance
+
+        for key in changed_fields:
+            setattr(instance, key, serializer.validated_data[key])
+
+        update_fields = list(changed_fields.values())
+        model_fields = {field.name for field in instance._meta.concrete_fields}
+
+        for audit_field in ("modified_at", "modified_by"):
+            if audit_field in model_fields and audit_field not in update_fields:
+                update_fields.append(audit_field)
+
+        instance.save(update_fields=update_fields)
+
+    def _parse_cursor(self, timestamp, pk, watermark):
+        if not timestamp and not pk:
+            return None
+
+        timestamp = parse_datetime(timestamp)
+
+        if timestamp is None or not pk:
+            raise ValueError("Invalid watermark: {0}".format(watermark))
+
+        return timestamp, pk
+
+    def parse_watermark(self, watermark):
+        """
+        A watermark is `<modified_at ISO 8601>|<pk>` of the last record a client has seen, followed by
+        `|<deleted_at ISO 8601>|<tombstone pk>` of the last deletion. Returns the (record, tombstone)
+        cursors, each a (time, pk) tuple or None.
+        """
+        if not watermark:
+            return None, None
+
+        parts = watermark.split("|")
+
+        if len(parts) not in (2, 4):
+            raise ValueError("Invalid watermark: {0}".format(watermark))
+
+        record_cursor = self._parse_cursor(parts[0], parts[1], watermark)
+        tombstone_cursor = self._parse_cursor(parts[2], parts[3], watermark) if len(parts) == 4 else None
+
+        return record_cursor, tombstone_cursor
+
+    def format_watermark(self, record_cursor, tombstone_cursor):
+        def format_cursor(cursor):
+            return "{0}|{1}".format(cursor[0].isoformat(), cursor[1]) if cursor else "|"
+
+        return "{0}|{1}".format(format_cursor(record_cursor), format_cursor(tombstone_cursor))
+
+    def record_tombstone(self, instance, object_id):
+        if self.tombstone_model is not None:
+            self.tombstone_model.objects.using(instance._state.db).create(
+                model_label=instance._meta.label,
+                object_id=str(object_id),
+                deleted_by=self.get_user_sub(),
+            )
+
+    def _get_tombstone_queryset(self, using):
+        return self.tombstone_model.objects.using(using).filter(model_label=self.queryset.model._meta.label)
+
+    def get_latest_tombstone_cursor(self, using):
+        """ (deleted_at, pk) of the latest deletion, where a client that just synced everything starts from """
+        if self.tombstone_model is None:
+            return None
+
+        tombstones = self._get_tombstone_queryset(using).order_by("-deleted_at", "-pk")
+
+        return tombstones.values_list("deleted_at", "pk").first()
+
+    def get_tombstones(self, using, tombstone_cursor, record_cursor, limit):
+        """
+        (deleted_at, pk, object_id) of deletions after the tombstone cursor, oldest first. Watermarks
+        from before tombstone cursors existed only have a record cursor, deletions from its time on are
+        reported then, possibly more than once, which is harmless to apply again.
+        """
+        if self.tombstone_model is None:
+            return []
+
+        tombstones = self._get_tombstone_queryset(using)
+
+        if tombstone_cursor is not None:
+            deleted_at, pk = tombstone_cursor
+            tombstones = tombstones.filter(Q(deleted_at__gt=deleted_at) | Q(deleted_at=deleted_at, pk__gt=pk))
+        elif record_cursor is not None:
+            tombstones = tombstones.filter(deleted_at__gte=record_cursor[0])
+
+        return list(tombstones.order_by("deleted_at", "pk").values_list("deleted_at", "pk", "object_id")[:limit])
+
+    def _split_list(self, value):
+        """ A list kwarg may come as a list or as a comma separated string from a query string """
+        if not value:
+            return []
+
+        if isinstance(value, str):
+            value = value.split(",")
+
+        return [item.strip() for item in value if item.strip()]
+
+    def parse_aggregate_request(self, kwargs):
+        """
+        The group by fields, annotations and filters of an aggregate call, checked against the
+        service's `aggregate_options`. Aggregates are given as `<function>:<field>`, e.g. "sum:amount".
+        Raises ValueError for anything that isn't allowed.
+        """
+        group_by = self._split_list(kwargs.pop("group_by", None))
+        allowed_group_by = self.aggregate_options.get("GROUP_BY", [])
+        allowed_aggregates = self.aggregate_options.get("AGGREGATES", {})
+        allowed_filters = self.aggregate_options.get("FILTERS", [])
+
+        for field in group_by:
+            if field not in allowed_group_by:
+                raise ValueError("Grouping by {0} isn't allowed".format(field))
+
+        annotations = OrderedDict()
+
+        for aggregate in self._split_list(kwargs.pop("aggregates", None)) or ["count:pk"]:
+            function_name, _, field = aggregate.partition(":")
+            function = self.aggregate_functions.get(function_name)
+
+            if function is None:
+                raise ValueError("Unknown aggregate function {0}".format(function_name))
+
+            if field != "pk" and function_name not in allowed_aggregates.get(field, []):
+                raise ValueError("{0} of {1} isn't allowed".format(function_name, field))
+
+            if field == "pk" and function_name != "count":
+                raise ValueError("Only count is allowed on pk")
+
+            annotations["{0}_{1}".format(function_name, field)] = function(field)
+
+        filters = {}
+
+        for key, value in kwargs.items():
+            if key not in allowed_filters:
+                raise ValueError("Filtering on {0} isn't allowed".format(key))
+
+            filters[key] = value
+
+        return group_by, annotations, filters
+
     @RpcViewAdapter.auth
     def create(self, *args, **kwargs):
         serializer = self.get_serializer(data=kwargs)
@@ -113,6 +339,7 @@ class DjangoDataAccess(RpcViewAdapter):
             return {rpc_errors.VALIDATION_ERRORS_KEY: serializer.errors}
 
         serializer.save()
+        self.pin_reads_to_primary()
         return serializer.data
 
     @RpcViewAdapter.auth
@@ -123,30 +350,72 @@ class DjangoDataAccess(RpcViewAdapter):
         if page_size > settings.PAGINATION["MAX_PAGE_SIZE"]:
             page_size = settings.PAGINATION["MAX_PAGE_SIZE"]
 
-        page = self.paginate_queryset(self.queryset, page_num, page_size)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True, *args, **kwargs)
-            return self.get_paginated_response(serializer.data)
+        queryset = self.get_read_queryset(self.queryset)
 
-        serializer = self.get_serializer(self.queryset, many=True, *args, **kwargs)
-        return serializer.data
+        with statement_timeout(self.get_statement_timeout(), queryset.db):
+            page = self.paginate_queryset(queryset, page_num, page_size)
+            if page is not None:
+                serializer = self.get_serializer(page, many=True, *args, **kwargs)
+                return self.get_paginated_response(serializer.data)
+
+            serializer = self.get_serializer(queryset, many=True, *args, **kwargs)
+            return serializer.data
 
     @RpcViewAdapter.auth
     def retrieve(self, *args, **kwargs):
         try:
-            instance = self.get_object(**kwargs)
+            instance = self._lookup_object(self.get_read_queryset(self.queryset), kwargs)
         except ObjectDoesNotExist:
             return {rpc_errors.ERRORS_KEY: {rpc_errors.OBJ_NOT_FOUND_KEY: rpc_errors.OBJ_NOT_FOUND_ERROR_VALUE}}
 
         serializer = self.get_serializer(instance)
         return serializer.data
 
+    @RpcViewAdapter.auth
+    def retrieve_many(self, *args, **kwargs):
+        """
+        The objects with the given `ids` in one query, keyed by ID, for batching lookups (e.g. the
+        gateway's `expand`). At most MAX_PAGE_SIZE IDs per call. IDs that don't exist, or aren't
+        valid primary keys, are listed in `meta.missing`.
+        """
+        ids = kwargs.pop("ids", None) or []
+
+        if isinstance(ids, str):
+            ids = ids.split(",")
+
+        ids = list(OrderedDict.fromkeys(str(pk) for pk in ids))
+        max_ids = settings.PAGINATION["MAX_PAGE_SIZE"]
+
+        if len(ids) > max_ids:
+            return {rpc_errors.ERRORS_KEY: {rpc_errors.TOO_MANY_IDS_KEY: rpc_errors.TOO_MANY_IDS_VALUE.format(max_ids)}}
+
+        pk_field = self.queryset.model._meta.pk
+        # Requested ID -> primary key value, so e.g. UUIDs match however the caller formatted them.
+        pks = OrderedDict()
+
+        for pk in ids:
+            try:
+                pks[pk] = pk_field.to_python(pk)
+            except ValidationError:
+                pass
+
+        instances = self.get_read_queryset(self.queryset).in_bulk(list(pks.values()))
+        found = [pk for pk, value in pks.items() if value in instances]
+        serializer = self.get_serializer([instances[pks[pk]] for pk in found], many=True)
+
+        return OrderedDict([
+            ("results", OrderedDict(zip(found, serializer.data))),
+            ("meta", {
+                "missing": [pk for pk in ids if pk not in pks or pks[pk] not in instances],
+            })
+        ])
+
     @RpcViewAdapter.auth
     def update(self, *args, **kwargs):
         partial = kwargs.pop("partial", False)
 
         try:
-            instance = self.get_object(**kwargs)
+            instance = self._lookup_object(self.get_write_queryset(self.queryset), kwargs)
         except ObjectDoesNotExist:
             return {rpc_errors.ERRORS_KEY: {rpc_errors.OBJ_NOT_FOUND_KEY: rpc_errors.OBJ_NOT_FOUND_ERROR_VALUE}}
 
@@ -155,16 +424,131 @@ class DjangoDataAccess(RpcViewAdapter):
         if not serializer.is_valid():
             return {rpc_errors.VALIDATION_ERRORS_KEY: serializer.errors}
 
-        serializer.save()
+        changed_fields = self.get_changed_fields(instance, serializer.validated_data)
+
+        # Nothing changed, skip the write entirely.
+        if changed_fields == {}:
+            return serializer.data
+
+        self.perform_update(serializer, changed_fields)
+        self.pin_reads_to_primary()
         return serializer.data
 
     @RpcViewAdapter.auth
     def delete(self, *args, **kwargs):
         try:
-            instance = self.get_object(**kwargs)
+            instance = self._lookup_object(self.get_write_queryset(self.queryset), kwargs)
         except ObjectDoesNotExist:
             return {rpc_errors.ERRORS_KEY: {rpc_errors.OBJ_NOT_FOUND_KEY: rpc_errors.OBJ_NOT_FOUND_ERROR_VALUE}}
 
         instance_id = instance.id
-        instance.delete()
+
+        with transaction.atomic(using=instance._state.db):
+            instance.delete()
+            self.record_tombstone(instance, instance_id)
+
+        self.pin_reads_to_primary()
         return {"id": str(instance_id)}
+
+    @RpcViewAdapter.auth
+    def changes(self, *args, **kwargs):
+        """
+        Records modified after the `since` watermark, ordered by (modified_at, pk), and the IDs of
+        records deleted since then, both paged by `page_size`. Without `since` only records are returned.
+        Pass `meta.next_watermark` back as `since` to get the next page.
+        """
+        page_size = int(kwargs.pop("page_size", settings.PAGINATION["PAGE_SIZE"]))
+
+        if page_size > settings.PAGINATION["MAX_PAGE_SIZE"]:
+            page_size = settings.PAGINATION["MAX_PAGE_SIZE"]
+
+        watermark = kwargs.pop("since", None)
+
+        try:
+            record_cursor, tombstone_cursor = self.parse_watermark(watermark)
+        except ValueError:
+            return {rpc_errors.ERRORS_KEY: {rpc_errors.INVALID_WATERMARK_KEY: rpc_errors.INVALID_WATERMARK_VALUE}}
+
+        queryset = self.get_read_queryset(self.queryset)
+
+        if record_cursor is not None:
+            modified_at, pk = record_cursor
+            queryset = queryset.filter(Q(modified_at__gt=modified_at) | Q(modified_at=modified_at, pk__gt=pk))
+
+        with statement_timeout(self.get_statement_timeout(), queryset.db):
+            if not watermark:
+                # An initial sync has nothing to delete yet. Deletions from here on are reported by the
+                # next calls, taken before the records so none between the two can be missed.
+                tombstone_cursor = self.get_latest_tombstone_cursor(queryset.db)
+
+            records = list(queryset.order_by("modified_at", "pk")[:page_size + 1])
+            has_more = len(records) > page_size
+            records = records[:page_size]
+
+            tombstones = []
+
+            if watermark:
+                tombstones = self.get_tombstones(queryset.db, tombstone_cursor, record_cursor, page_size + 1)
+                has_more = has_more or len(tombstones) > page_size
+                tombstones = tombstones[:page_size]
+
+            serializer = self.get_serializer(records, many=True)
+
+        if records:
+            record_cursor = (records[-1].modified_at, records[-1].pk)
+
+        if tombstones:
+            tombstone_cursor = tombstones[-1][:2]
+
+        return OrderedDict([
+            ("results", serializer.data),
+            ("deleted", [object_id for _, _, object_id in tombstones]),
+            ("meta", {
+                "next_watermark": self.format_watermark(record_cursor, tombstone_cursor),
+                "has_more": has_more,
+                "page_size": page_size,
+            })
+        ])
+
+    @RpcViewAdapter.auth
+    def aggregate(self, *args, **kwargs):
+        """
+        Counts, sums, averages, minimums or maximums grouped by the `group_by` fields in a single
+        query, e.g. group_by="status", aggregates="count:pk,sum:amount", plus any allowed filters.
+        """
+        try:
+            group_by, annotations, filters = self.parse_aggregate_request(kwargs)
+        except ValueError as ex:
+            return {rpc_errors.ERRORS_KEY: {rpc_errors.INVALID_AGGREGATE_KEY: str(ex)}}
+
+        max_groups = self.aggregate_options.get("MAX_GROUPS", 1000)
+        queryset = self.get_read_queryset(self.queryset)
+
+        try:
+            # Filter values are only checked against their fields here, and some only once the query runs.
+            queryset = queryset.filter(**filters)
+
+            with statement_timeout(self.get_statement_timeout(), queryset.db):
+                if group_by:
+                    # order_by replaces any default ordering, which would otherwise be added to the GROUP BY.
+                    rows = list(
+                        queryset.values(*group_by).annotate(**annotations).order_by(*group_by)[:max_groups + 1]
+                    )
+                else:
+                    rows = [queryset.aggregate(**annotations)]
+        except ValidationError as ex:
+            return {rpc_errors.ERRORS_KEY: {rpc_errors.INVALID_AGGREGATE_KEY: " ".join(ex.messages)}}
+        except (ValueError, TypeError) as ex:
+            return {rpc_errors.ERRORS_KEY: {rpc_errors.INVALID_AGGREGATE_KEY: str(ex)}}
+
+        truncated = len(rows) > max_groups
+
+        return OrderedDict([
+            # Decimals, dates and UUIDs as strings, the same as the serializers give them.
+            ("results", json.loads(json.dumps(rows[:max_groups], cls=DjangoJSONEncoder))),
+            ("meta", {
+                "group_by": group_by,
+                "aggregates": list(annotations.keys()),
+                "truncated": truncated,
+            })
+        ])
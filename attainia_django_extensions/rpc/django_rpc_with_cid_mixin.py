@@ -8,6 +8,16 @@ from django.utils.module_loading import import_string
 
 from cid import locals
 
+from .claim_check import ClaimCheckedReply, fetch_payload
+from .deadline import propagate_deadline
+from .profiling import propagate_profile
+from ..tracing.tracer import propagate_trace
+from .resilient_call import call_with_resilience
+
+
+# The connection pool provider, resolved from the settings on first use.
+_connection_pool_provider = None
+
 
 """
 A mixin class for making RPC calls.
@@ -27,14 +37,25 @@ class DjangoRpcWithCidMixin(object):
 
         RPC_CONNECTION_POOL_PROVIDER = "django_nameko.get_pool"
 
+    or the package's own managed pool, see `rpc_connection_pool`.
+
+        RPC_CONNECTION_POOL_PROVIDER = "attainia_django_extensions.rpc.rpc_connection_pool.get_pool"
+
+    Circuit breaking and hedged reads are configured with the optional RPC_RESILIENCE setting,
+    see `resilient_call`. The deadline of the current call is passed on with the CID, see `deadline`.
+
     """
     logger = logging.getLogger(__name__)
 
     def _get_connection_pool(self):
         """ Get a connection from the pool """
+        global _connection_pool_provider
+
         # Connection pool for RPC cluster.
-        conn_pool_provider_path = import_string(settings.RPC_CONNECTION_POOL_PROVIDER)
-        return conn_pool_provider_path()
+        if _connection_pool_provider is None:
+            _connection_pool_provider = import_string(settings.RPC_CONNECTION_POOL_PROVIDER)
+
+        return _connection_pool_provider()
 
     def call_service_method(self, service_name: str, method_name: str, use_async: bool, *args, **kwargs):
         """ Call an RPC method from a service """
@@ -44,15 +65,28 @@ class DjangoRpcWithCidMixin(object):
             # Get the correlation ID if it exists, otherwise create one
             cid = locals.get_cid() or str(uuid4())
 
-            with self._get_connection_pool().next() as rpc:
-                service = getattr(rpc, service_name)
-                method = getattr(service, method_name)
-                new_kwargs = {**kwargs, **{"cid": cid}}
-
-                if use_async:
-                    return method.call_async(*args, **new_kwargs)
-                else:
-                    return method(*args, **new_kwargs)
+            new_kwargs = {**kwargs, **{"cid": cid}}
+            propagate_trace(new_kwargs)
+            propagate_profile(new_kwargs)
+            propagate_deadline(new_kwargs, getattr(settings, "RPC_DEADLINE", {}).get("HOP_MARGIN", 0.0))
+
+            def invoke():
+                with self._get_connection_pool().next() as rpc:
+                    service = getattr(rpc, service_name)
+                    method = getattr(service, method_name)
+
+                    if use_async:
+                        return ClaimCheckedReply(method.call_async(*args, **new_kwargs))
+                    else:
+                        return fetch_payload(method(*args, **new_kwargs))
+
+            return call_with_resilience(
+                service_name,
+                method_name,
+                use_async,
+                invoke,
+                getattr(settings, "RPC_RESILIENCE", {}),
+            )
 
         except Exception as ex:
             self.logger.error("RPC call failed with error %s", getattr(ex, 'message', repr(ex)))
@@ -6,6 +6,7 @@ from functools import reduce
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.paginator import Paginator
+from django.db import OperationalError
 from django.db.models import Q
 from django.db.models.constants import LOOKUP_SEP
 from django.db.models.query import QuerySet
@@ -13,15 +14,22 @@ from django.db.models.query import QuerySet
 from nameko.extensions import DependencyProvider
 
 from . import rpc_errors
+from .db_connection_pool import PooledDbConnectionsMixin
+from .deadline import is_expired
+from .replica_router import ReadReplicaMixin
 from .rpc_view_adapter import RpcViewAdapter
+from .search_query_planner import SearchBudgetExceeded, SearchQueryPlanner
+from .statement_timeout import is_statement_timeout, statement_timeout
 
 
 def querydict_to_dict(querydict):
     return {k: v[0] if len(v) == 1 else v for k, v in querydict.lists()}
 
-class DjangoSearchProvider(DependencyProvider):
+class DjangoSearchProvider(PooledDbConnectionsMixin, DependencyProvider):
+    """ Workers share pooled database connections when DB_CONNECTION_POOL is configured, see `db_connection_pool` """
 
     def setup(self):
+        super().setup()
 
         if self.container.get_queryset:
             self.queryset = self.container.get_queryset()
@@ -41,13 +49,16 @@ class DjangoSearchProvider(DependencyProvider):
             self.search_fields
 
     def get_dependency(self, worker_ctx):
-        return DjangoSearch(self.queryset, self.serializer_class, self.search_fields)
+        return DjangoSearch(self.queryset, self.serializer_class, self.search_fields, worker_ctx)
 
 
-class DjangoSearch(RpcViewAdapter):
+class DjangoSearch(RpcViewAdapter, ReadReplicaMixin):
     """
     Provides common DRF ViewSet-like abstractions for interacting with models
     and serializers via RPC.
+
+    Searches go to a read replica when DATABASE_READ_REPLICAS is configured, see `replica_router`.
+    Search terms are normalized and checked against a cost budget first, see `search_query_planner`.
     """
     search_lookup_prefixes = {
         "^": "istartswith",
@@ -56,7 +67,10 @@ class DjangoSearch(RpcViewAdapter):
         "$": "iregex",
     }
 
-    def __init__(self, queryset, serializer_class, search_fields):
+    search_planner_class = SearchQueryPlanner
+
+    def __init__(self, queryset, serializer_class, search_fields, worker_ctx=None):
+        super().__init__(worker_ctx)
         self.queryset = queryset
         self.serializer_class = serializer_class
         self.search_fields = search_fields
@@ -85,32 +99,34 @@ class DjangoSearch(RpcViewAdapter):
     def get_search_fields(self):
         return self.search_fields
 
-    def construct_search(self, field_name):
+    def get_search_planner(self):
+        return self.search_planner_class.from_settings()
+
+    def construct_search(self, field_name, prefix=False):
         lookup = self.search_lookup_prefixes.get(field_name[0])
         if lookup:
             field_name = field_name[1:]
+        elif prefix:
+            # Prefix matches can use an index, contains matches can't.
+            lookup = "istartswith"
         else:
             lookup = "icontains"
         return LOOKUP_SEP.join([field_name, lookup])
 
     def search_queryset(self, queryset, search_terms):
         search_fields = self.get_search_fields()
-        search_terms = search_terms.replace(",", " ").split()
+        # Regex terms differing only in case mean different things, e.g. \D and \d.
+        case_sensitive = any(search_field.startswith("$") for search_field in search_fields)
+        search_terms = self.get_search_planner().plan(search_terms, len(search_fields), case_sensitive)
 
         if not search_fields or not search_terms:
             return queryset
 
-        orm_lookups = [
-            self.construct_search(search_field)
-            for search_field in search_fields
-        ]
-
-        base = queryset
         conditions = []
         for search_term in search_terms:
             queries = [
-                Q(**{orm_lookup: search_term})
-                for orm_lookup in orm_lookups
+                Q(**{self.construct_search(search_field, search_term.prefix): search_term.text})
+                for search_field in search_fields
             ]
             conditions.append(reduce(operator.or_, queries))
         queryset = queryset.filter(reduce(operator.and_, conditions))
@@ -127,14 +143,32 @@ class DjangoSearch(RpcViewAdapter):
 
         search_terms = kwargs.pop("query", "")
 
-        if not search_terms:
+        if not self.get_search_planner().normalize_terms(search_terms):
             return {rpc_errors.ERRORS_KEY: {rpc_errors.MISSING_SEARCH_PARAM_KEY: rpc_errors.MISSING_SEARCH_PARAM_VALUE}}
 
-        queryset = self.search_queryset(self.queryset, search_terms)
-        page = self.paginate_queryset(queryset, page_num, page_size)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True, *args, **kwargs)
-            return self.get_paginated_response(serializer.data)
+        try:
+            queryset = self.search_queryset(self.get_read_queryset(self.queryset), search_terms)
+        except SearchBudgetExceeded as ex:
+            self.logger.warning("Rejecting search: %s", str(ex))
+            return {rpc_errors.ERRORS_KEY: {rpc_errors.SEARCH_TOO_EXPENSIVE_KEY: str(ex)}}
+
+        timeout = getattr(settings, "SEARCH_QUERY_PLANNER", {}).get("STATEMENT_TIMEOUT")
+        timeout = self.get_statement_timeout(timeout)
+
+        try:
+            with statement_timeout(timeout, queryset.db):
+                page = self.paginate_queryset(queryset, page_num, page_size)
+                if page is not None:
+                    serializer = self.get_serializer(page, many=True, *args, **kwargs)
+                    return self.get_paginated_response(serializer.data)
+
+                serializer = self.get_serializer(queryset, many=True, *args, **kwargs)
+                return serializer.data
+
+        except OperationalError as ex:
+            # Left to the auth wrapper to report when it was the caller's deadline that ran out.
+            if not is_statement_timeout(ex) or is_expired():
+                raise
 
-        serializer = self.get_serializer(queryset, many=True, *args, **kwargs)
-        return serializer.data
+            self.logger.warning("Search exceeded the statement timeout of %s ms", timeout)
+            return {rpc_errors.ERRORS_KEY: {rpc_errors.QUERY_TIMEOUT_KEY: rpc_errors.QUERY_TIMEOUT_VALUE}}
@@ -0,0 +1,82 @@
+""" Hedged RPC calls for idempotent service methods """
+import math
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+# Only reads are safe to send twice.
+HEDGEABLE_METHODS = ("list", "retrieve", "retrieve_many", "search")
+
+
+class LatencyTracker(object):
+    """ Rolling window of call latencies (in seconds) per service method """
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, key, latency: float):
+        with self._lock:
+            samples = self._samples.get(key)
+
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.window)
+
+            samples.append(latency)
+
+    def percentile(self, key, percent: float, min_samples: int = 20):
+        """ Latency at the given percentile, or None until enough samples are collected """
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+
+        if len(samples) < min_samples:
+            return None
+
+        index = max(0, int(math.ceil(percent / 100.0 * len(samples))) - 1)
+        return samples[index]
+
+
+latency_tracker = LatencyTracker()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(max_workers: int):
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rpc-hedge")
+
+    return _executor
+
+
+def hedged_call(call, delay: float, max_workers: int = 32):
+    """
+    Run `call`, and if it has not returned after `delay` seconds run it a second time.
+    The first successful reply wins; the loser is left to finish in the background.
+    """
+    executor = _get_executor(max_workers)
+    first = executor.submit(call)
+    done, _ = wait([first], timeout=delay)
+
+    if done:
+        return first.result()
+
+    pending = {first, executor.submit(call)}
+    error = None
+
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+
+            error = future.exception()
+
+    raise error
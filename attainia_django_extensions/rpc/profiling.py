@@ -0,0 +1,129 @@
+"""
+On-demand profiling of gateway views and RPC handlers.
+
+    A request is profiled when it carries the configured header with the secret TOKEN, or is picked
+    by SAMPLE_RATE. The decision travels with the CID as the `profile` kwarg, so every service the
+    request reaches profiles its part too. Each profiled call writes a cProfile dump, readable with
+    `pstats` or snakeviz, to DIRECTORY/<cid>/.
+
+        RPC_PROFILING = {
+            "HEADER": "HTTP_X_PROFILE",
+            "TOKEN": "<secret>",
+            "SAMPLE_RATE": 0.0,
+            "DIRECTORY": "/tmp/rpc-profiles",
+        }
+
+    Without the setting, or for requests that aren't picked, calls run as they are.
+
+"""
+import hmac
+import logging
+import os
+import random
+import re
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+
+from cid import locals
+
+
+logger = logging.getLogger(__name__)
+
+# Per request, see the note on `deadline._deadline`.
+_profile_requested = ContextVar("rpc_profile_requested", default=False)
+_profiler_lock = threading.Lock()
+
+
+def set_profile_requested(requested: bool):
+    _profile_requested.set(bool(requested))
+
+
+def is_profile_requested() -> bool:
+    return _profile_requested.get()
+
+
+def propagate_profile(kwargs: dict):
+    """ Ask the next hop to profile its part of a profiled request """
+    if is_profile_requested():
+        kwargs["profile"] = True
+
+    return kwargs
+
+
+def request_profile_from_header(request):
+    """ Request profiling of a gateway request that carries the configured header and token """
+    profiling_settings = getattr(settings, "RPC_PROFILING", None)
+    token = profiling_settings.get("TOKEN") if profiling_settings else None
+    value = request.META.get(profiling_settings.get("HEADER", "HTTP_X_PROFILE")) if token else None
+
+    set_profile_requested(bool(value) and hmac.compare_digest(str(value), str(token)))
+
+
+def _should_profile(profiling_settings):
+    if is_profile_requested():
+        return True
+
+    sample_rate = profiling_settings.get("SAMPLE_RATE", 0.0)
+
+    if sample_rate and random.random() < sample_rate:
+        # Profile the rest of the request downstream as well.
+        set_profile_requested(True)
+        return True
+
+    return False
+
+
+def call_profiled(label: str, function, *args, **kwargs):
+    """
+    Call the function, under cProfile if this request is to be profiled. Only one call per process
+    is profiled at a time, Python allows a single active profiler and under eventlet every worker
+    shares the thread. Calls that can't be profiled run as they are.
+    """
+    profiling_settings = getattr(settings, "RPC_PROFILING", None)
+
+    if not profiling_settings or not _should_profile(profiling_settings):
+        return function(*args, **kwargs)
+
+    if not _profiler_lock.acquire(blocking=False):
+        logger.info("Not profiling %s, another call is being profiled", label)
+        return function(*args, **kwargs)
+
+    try:
+        import cProfile
+
+        profiler = cProfile.Profile()
+
+        try:
+            profiler.enable()
+        except ValueError as ex:
+            # Another profiling tool (a debugger, coverage) is active.
+            logger.warning("Not profiling %s, %s", label, str(ex))
+            return function(*args, **kwargs)
+
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profiler.disable()
+            _dump_profile(profiler, profiling_settings, label)
+
+    finally:
+        _profiler_lock.release()
+
+
+def _dump_profile(profiler, profiling_settings, label):
+    directory = os.path.join(
+        profiling_settings.get("DIRECTORY", "/tmp/rpc-profiles"),
+        # The CID comes from the caller, keep it to a safe single path component.
+        re.sub(r"[^\w\-]", "_", locals.get_cid() or "no-cid"),
+    )
+    path = os.path.join(directory, "{0}.{1}.{2}.prof".format(label, os.getpid(), int(time.time() * 1000)))
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(path)
+        logger.info("Profile written to %s", path)
+    except Exception as ex:
+        logger.warning("Writing profile %s failed with error %s", path, repr(ex))
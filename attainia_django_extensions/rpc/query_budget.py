@@ -0,0 +1,132 @@
+"""
+Per-RPC query budgets and N+1 detection for RpcViewAdapter methods.
+
+    Enabled with an optional dictionary in the Django settings. Budgets are looked up by
+    "<ViewClass>.<method>", then by method name, then DEFAULT. DB time is in milliseconds.
+
+        RPC_QUERY_BUDGETS = {
+            "ENABLED": True,
+            "DEFAULT": {"MAX_QUERIES": 20, "MAX_DB_TIME": 500},
+            "METHODS": {
+                "list": {"MAX_QUERIES": 5},
+                "AssetDataAccess.retrieve": {"MAX_QUERIES": 3},
+            },
+            "N_PLUS_ONE_THRESHOLD": 5,
+            "EXPORTER": "myproject.metrics.export_query_budget_violation",
+            "INCLUDE_IN_META": True,
+        }
+
+    Violations are logged, and passed to the optional EXPORTER callable as a dictionary. With DEBUG on,
+    the query stats are also added to the `meta` of paginated responses.
+
+"""
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+# Collapse IN (%s, %s, ...) lists so the same query with a different number of IDs has the same shape.
+_PLACEHOLDER_LIST = re.compile(r"%s(\s*,\s*%s)+")
+
+_exporters = {}
+
+
+class QueryStats(object):
+    """ Database execute wrapper counting queries, DB time and repeated query shapes """
+
+    def __init__(self):
+        self.count = 0
+        self.db_time = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.db_time += time.perf_counter() - start
+            self.shapes[_PLACEHOLDER_LIST.sub("%s", sql)] += 1
+
+    def repeated_shapes(self, threshold: int):
+        """ Query shapes run at least `threshold` times, the signature of an N+1 """
+        return {shape: count for shape, count in self.shapes.items() if count >= threshold}
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "db_time": round(self.db_time * 1000, 3),
+        }
+
+
+@contextmanager
+def track_queries():
+    """ Collect QueryStats for every database connection of the current thread """
+    stats = QueryStats()
+
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(stats))
+
+        yield stats
+
+
+def _get_budget(budget_settings: dict, view_name: str, method_name: str):
+    methods = budget_settings.get("METHODS", {})
+    budget = dict(budget_settings.get("DEFAULT", {}))
+    budget.update(methods.get(method_name, {}))
+    budget.update(methods.get("{0}.{1}".format(view_name, method_name), {}))
+    return budget
+
+
+def _export(exporter_path: str, report: dict):
+    exporter = _exporters.get(exporter_path)
+
+    if exporter is None:
+        exporter = _exporters[exporter_path] = import_string(exporter_path)
+
+    try:
+        exporter(report)
+    except Exception as ex:
+        logger.warning("Query budget exporter failed with error %s", repr(ex))
+
+
+def check_query_budget(view_name: str, method_name: str, stats: QueryStats, budget_settings: dict):
+    """ Log and export budget violations and suspected N+1 queries, returning the violations """
+    budget = _get_budget(budget_settings, view_name, method_name)
+    db_time = stats.db_time * 1000
+    violations = []
+
+    if "MAX_QUERIES" in budget and stats.count > budget["MAX_QUERIES"]:
+        violations.append("{0} queries, budget is {1}".format(stats.count, budget["MAX_QUERIES"]))
+
+    if "MAX_DB_TIME" in budget and db_time > budget["MAX_DB_TIME"]:
+        violations.append("{0:.1f} ms of DB time, budget is {1} ms".format(db_time, budget["MAX_DB_TIME"]))
+
+    repeated = stats.repeated_shapes(budget_settings.get("N_PLUS_ONE_THRESHOLD", 5))
+
+    for shape, count in repeated.items():
+        violations.append("possible N+1, query run {0} times: {1}".format(count, shape))
+
+    if violations:
+        logger.warning("%s.%s query budget exceeded: %s", view_name, method_name, "; ".join(violations))
+
+        if budget_settings.get("EXPORTER"):
+            _export(budget_settings["EXPORTER"], {
+                "view": view_name,
+                "method": method_name,
+                "queries": stats.count,
+                "db_time": db_time,
+                "repeated_queries": repeated,
+                "violations": violations,
+            })
+
+    return violations
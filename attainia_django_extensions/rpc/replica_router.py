@@ -0,0 +1,183 @@
+"""
+Read replica routing with read-your-writes for the Django data access and search providers.
+
+    Reads (list, retrieve, search) go to one of the configured replica database aliases, writes
+    (create, update, delete) go to the primary. After a write, reads keyed by the same correlation ID
+    (or the user's JWT `sub`) are pinned to the primary for a short window so they can't see stale data.
+    Replicas lagging further behind than MAX_LAG seconds are skipped until they catch up.
+
+        DATABASE_READ_REPLICAS = {
+            "PRIMARY": "default",
+            "REPLICAS": ["replica"],
+            "READ_YOUR_WRITES_WINDOW": 5,
+            "READ_YOUR_WRITES_KEY": "cid",  # or "sub"
+            "MAX_LAG": 2,
+            "LAG_CHECK_INTERVAL": 10,
+            "CACHE": "default",
+        }
+
+    The pins are kept in the Django cache, so use a cache shared by every instance of the service.
+
+"""
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+from cid import locals
+
+
+class ReplicaRouter(object):
+    """ Picks the database alias for reads and remembers recent writers """
+    logger = logging.getLogger(__name__)
+    pin_key_prefix = "replica_router:pin:"
+
+    def __init__(self, replicas, primary="default", window=5, max_lag=None, lag_check_interval=10,
+                 cache_alias="default"):
+        self.replicas = list(replicas)
+        self.primary = primary
+        self.window = window
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self.cache_alias = cache_alias
+        # alias -> (checked at, healthy)
+        self._lag_checks = {}
+        self._lag_lock = threading.Lock()
+
+    def _get_cache(self):
+        from django.core.cache import caches
+
+        return caches[self.cache_alias]
+
+    def pin(self, key):
+        """ Send reads for the key to the primary for the read-your-writes window """
+        if key:
+            self._get_cache().set(self.pin_key_prefix + str(key), True, self.window)
+
+    def is_pinned(self, key):
+        return bool(key) and self._get_cache().get(self.pin_key_prefix + str(key), False)
+
+    def db_for_read(self, key=None):
+        if not self.replicas or self.is_pinned(key):
+            return self.primary
+
+        replicas = [alias for alias in self.replicas if self._is_replica_healthy(alias)]
+
+        if not replicas:
+            self.logger.warning("No read replica within the lag threshold, reading from the primary")
+            return self.primary
+
+        return random.choice(replicas)
+
+    def db_for_write(self):
+        return self.primary
+
+    def get_replica_lag(self, alias):
+        """ Replication lag in seconds, or None if it can't be determined """
+        connection = connections[alias]
+
+        if connection.vendor != "postgresql":
+            return 0.0
+
+        # The last replayed transaction's age only measures lag while there is WAL left to replay,
+        # a caught up replica of a quiet primary would otherwise look further behind by the second.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+            )
+            return float(cursor.fetchone()[0])
+
+    def _is_replica_healthy(self, alias):
+        if self.max_lag is None:
+            return True
+
+        now = time.monotonic()
+        checked_at, healthy = self._lag_checks.get(alias, (None, True))
+
+        if checked_at is not None and now - checked_at < self.lag_check_interval:
+            return healthy
+
+        try:
+            lag = self.get_replica_lag(alias)
+        except Exception as ex:
+            self.logger.warning("Replica lag check failed for %s with error %s", alias, repr(ex))
+            lag = None
+
+        healthy = lag is not None and lag <= self.max_lag
+
+        if not healthy:
+            self.logger.warning("Replica %s lag %s exceeds threshold %s", alias, lag, self.max_lag)
+
+        with self._lag_lock:
+            self._lag_checks[alias] = (now, healthy)
+
+        return healthy
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_replica_router():
+    """ Process wide router built from the DATABASE_READ_REPLICAS setting, or None if it isn't configured """
+    global _router
+
+    replica_settings = getattr(settings, "DATABASE_READ_REPLICAS", None)
+
+    if not replica_settings:
+        return None
+
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = ReplicaRouter(
+                    replica_settings.get("REPLICAS", []),
+                    primary=replica_settings.get("PRIMARY", "default"),
+                    window=replica_settings.get("READ_YOUR_WRITES_WINDOW", 5),
+                    max_lag=replica_settings.get("MAX_LAG"),
+                    lag_check_interval=replica_settings.get("LAG_CHECK_INTERVAL", 10),
+                    cache_alias=replica_settings.get("CACHE", "default"),
+                )
+
+    return _router
+
+
+class ReadReplicaMixin(object):
+    """ Routing helpers for RpcViewAdapter based data access classes """
+
+    def get_read_your_writes_key(self):
+        key_type = getattr(settings, "DATABASE_READ_REPLICAS", {}).get("READ_YOUR_WRITES_KEY", "cid")
+
+        if key_type == "sub":
+            user = getattr(self.request, "user", None)
+            return user.get("sub") if isinstance(user, dict) else None
+
+        return locals.get_cid()
+
+    def get_read_queryset(self, queryset):
+        """ The queryset on a replica, unless this caller wrote recently """
+        router = get_replica_router()
+
+        if router is None:
+            return queryset
+
+        return queryset.using(router.db_for_read(self.get_read_your_writes_key()))
+
+    def get_write_queryset(self, queryset):
+        """ The queryset on the primary, for objects that are about to be written """
+        router = get_replica_router()
+
+        if router is None:
+            return queryset
+
+        return queryset.using(router.db_for_write())
+
+    def pin_reads_to_primary(self):
+        router = get_replica_router()
+
+        if router is not None:
+            router.pin(self.get_read_your_writes_key())
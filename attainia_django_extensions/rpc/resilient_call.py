@@ -0,0 +1,78 @@
+""" Circuit breaking and hedging shared by the RPC client mixins """
+import time
+
+from .circuit_breaker import get_circuit_breaker
+from .hedged_call import HEDGEABLE_METHODS, hedged_call, latency_tracker
+
+
+"""
+    Both options are configured with an optional RPC_RESILIENCE dictionary, in the Django settings
+    for DjangoRpcWithCidMixin or in the Nameko config for RpcWithCid.
+
+        RPC_RESILIENCE = {
+            "CIRCUIT_BREAKER": {
+                "ENABLED": True,
+                "FAILURE_THRESHOLD": 5,
+                "RESET_TIMEOUT": 30,
+            },
+            "HEDGING": {
+                "ENABLED": False,
+                "PERCENTILE": 95,
+                "MIN_SAMPLES": 20,
+                "MIN_DELAY": 0.05,
+                "MAX_DELAY": 2.0,
+                "MAX_WORKERS": 32,
+            },
+        }
+
+"""
+def _hedge_delay(key, hedging: dict):
+    delay = latency_tracker.percentile(key, hedging.get("PERCENTILE", 95), hedging.get("MIN_SAMPLES", 20))
+
+    if delay is None:
+        return None
+
+    return min(max(delay, hedging.get("MIN_DELAY", 0.05)), hedging.get("MAX_DELAY", 2.0))
+
+
+def call_with_resilience(service_name: str, method_name: str, use_async: bool, invoke, options: dict):
+    """ Invoke an RPC through the service's circuit breaker, hedging idempotent reads """
+    breaker_options = options.get("CIRCUIT_BREAKER", {})
+    hedging = options.get("HEDGING", {})
+    breaker = None
+
+    if breaker_options.get("ENABLED", True):
+        breaker = get_circuit_breaker(
+            service_name,
+            breaker_options.get("FAILURE_THRESHOLD", 5),
+            breaker_options.get("RESET_TIMEOUT", 30.0),
+        )
+
+    key = (service_name, method_name)
+
+    def timed_invoke():
+        start = time.monotonic()
+        result = invoke()
+
+        # An async call returns as soon as the request is published, so its latency means nothing.
+        if not use_async:
+            latency_tracker.record(key, time.monotonic() - start)
+
+        return result
+
+    def resilient_invoke():
+        delay = None
+
+        if not use_async and hedging.get("ENABLED", False) and method_name in HEDGEABLE_METHODS:
+            delay = _hedge_delay(key, hedging)
+
+        if delay is None:
+            return timed_invoke()
+
+        return hedged_call(timed_invoke, delay, hedging.get("MAX_WORKERS", 32))
+
+    if breaker is None:
+        return resilient_invoke()
+
+    with breaker.guard():
+        return resilient_invoke()
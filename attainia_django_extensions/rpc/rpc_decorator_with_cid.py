@@ -1,25 +1,45 @@
 """
 Abstraction for Nameko RPC decorator to add the CID to local thread for logging.
-"""
-from uuid import uuid4
 
-from nameko.rpc import rpc as nameko_rpc
+Oversized results are claim-checked when CLAIM_CHECK is configured, see `claim_check`. Calls
+arriving after their deadline are answered with a `deadline_exceeded` error, see `deadline`. Each
+call is recorded as a span when TRACING is configured, see `tracing.tracer`, and the `profile` flag
+is kept for RpcViewAdapter, see `profiling`.
 
-from cid import locals
+Nameko and the helpers are imported when the decorator is applied, not with this module.
+"""
+from uuid import uuid4
 
 
 def rpc_decorator_with_cid(*args, **kwargs):
     """ Wrap a Namkeo RPC call """
     def decorator_wrapper(function):
         """ Wrapper function for the decorator """
+        from nameko.rpc import rpc as nameko_rpc
+
+        from cid import locals
+
+        from .claim_check import offload_payload
+        from .deadline import deadline_exceeded_error, is_expired, set_deadline
+        from .profiling import set_profile_requested
+        from ..tracing.tracer import SERVER, trace_span
+
         @nameko_rpc(*args, **kwargs)
         def wrapper(self, *args, **kwargs):
             """ Call wrapped function getting cid from RPC call """
             cid = kwargs.pop("cid", str(uuid4()))
 
             locals.set_cid(cid)
+            set_deadline(kwargs.pop("deadline", None))
+            set_profile_requested(kwargs.pop("profile", False))
+            parent = kwargs.pop("trace", None)
+            span_name = "{0}.{1}".format(getattr(self, "name", type(self).__name__), function.__name__)
+
+            with trace_span(span_name, SERVER, parent):
+                if is_expired():
+                    return deadline_exceeded_error()
 
-            return function(self, *args, **kwargs)
+                return offload_payload(function(self, *args, **kwargs))
 
         return wrapper
 
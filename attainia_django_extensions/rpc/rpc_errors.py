@@ -18,3 +18,13 @@ OBJ_NOT_FOUND_KEY = "not_found"
 OBJ_NOT_FOUND_ERROR_VALUE = "No object found with that ID"
 MISSING_SEARCH_PARAM_KEY = "missing_search_param"
 MISSING_SEARCH_PARAM_VALUE = "Missing required search parameter"
+SEARCH_TOO_EXPENSIVE_KEY = "search_too_expensive"
+QUERY_TIMEOUT_KEY = "query_timeout"
+QUERY_TIMEOUT_VALUE = "Query exceeded the statement timeout"
+INVALID_WATERMARK_KEY = "invalid_watermark"
+INVALID_WATERMARK_VALUE = "Invalid changes watermark"
+INVALID_AGGREGATE_KEY = "invalid_aggregate"
+TOO_MANY_IDS_KEY = "too_many_ids"
+TOO_MANY_IDS_VALUE = "At most {0} IDs per call"
+DEADLINE_EXCEEDED_KEY = "deadline_exceeded"
+DEADLINE_EXCEEDED_VALUE = "Deadline exceeded before the call completed"
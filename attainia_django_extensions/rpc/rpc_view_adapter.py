@@ -4,7 +4,24 @@ authentication and permissions classes.
 """
 import logging
 
+from django.conf import settings
+from django.db import OperationalError
+
+from cid import locals
+
+from ..audit import set_audit_user
 from . import rpc_errors
+from .claims_envelope import InvalidClaimsEnvelope, verify_claims
+from .deadline import (
+    DeadlineExceeded, abort_queries_after_deadline, deadline_exceeded_error, is_expired, remaining_time
+)
+from .profiling import call_profiled
+from .query_budget import check_query_budget, track_queries
+from .statement_timeout import is_statement_timeout
+
+
+# Authenticator and permission instances, shared by every worker using the same policy classes.
+_policy_instances = {}
 
 
 class RpcViewAdapter(object):
@@ -15,22 +32,39 @@ class RpcViewAdapter(object):
 
     # Creating a mock request object to keep permissions and authorization classes interchangable with DRF.
     class Request:
-        user = None
-        auth = None
-        method = None
-        META = None
+        def __init__(self, worker_ctx=None):
+            self.user = None
+            self.auth = None
+            self.method = None
+            self.META = {}
+            self.worker_ctx = worker_ctx
+            self.context_data = worker_ctx.data if worker_ctx is not None else {}
+
+    request = None
 
-    request = Request()
+    def __init__(self, worker_ctx=None):
+        # Each Nameko worker gets its own adapter, and with it its own request, so concurrent
+        # workers never see each other's identity.
+        self.request = self.Request(worker_ctx)
 
     @classmethod
     def auth(cls, function):
         """ Authorization and Authentication decorator """
         def wrapper(self, *args, **kwargs):
             """ Decorator wrapping function """
-            self._put_jwt_on_auth_header(kwargs)
+            if self.request is None:
+                # Subclasses whose __init__ doesn't call super() get their request on first use.
+                self.request = self.Request()
+
+            jwt = self._put_jwt_on_auth_header(kwargs)
             self._set_request_method(function.__name__)
-            # Perform the authentication and authorization
-            auth_res = self.perform_authentication()
+            # Perform the authentication, unless the gateway forwarded claims it already verified,
+            # and authorization
+            auth_res = None
+
+            if not self._put_verified_claims_on_request(kwargs, jwt):
+                auth_res = self.perform_authentication()
+
             perm_res = self.check_permissions()
 
             if auth_res is not None:
@@ -39,15 +73,101 @@ class RpcViewAdapter(object):
             if perm_res is not None:
                 return perm_res
 
-            return function(self, *args, **kwargs)
+            # Writes to AuditTrailModels, bulk ones included, are stamped with the caller's sub.
+            set_audit_user(self.get_user_sub())
+
+            try:
+                return call_profiled(
+                    "{0}.{1}".format(type(self).__name__, function.__name__),
+                    self._call_before_deadline,
+                    function,
+                    *args,
+                    **kwargs
+                )
+            finally:
+                set_audit_user(None)
 
         return wrapper
 
+    def get_user_sub(self):
+        user = self.request.user
+        return user.get("sub") if isinstance(user, dict) else None
+
+    def _call_before_deadline(self, function, *args, **kwargs):
+        """ Call the wrapped method, abandoning its queries once the caller's deadline has passed """
+        if remaining_time() is None:
+            return self._call_with_query_budget(function, *args, **kwargs)
+
+        try:
+            with abort_queries_after_deadline():
+                return self._call_with_query_budget(function, *args, **kwargs)
+
+        except DeadlineExceeded as ex:
+            self.logger.warning("Abandoning %s, %s", function.__name__, str(ex))
+            return deadline_exceeded_error()
+
+        except OperationalError as ex:
+            if not (is_statement_timeout(ex) and is_expired()):
+                raise
+
+            self.logger.warning("Abandoning %s, the deadline passed during a query", function.__name__)
+            return deadline_exceeded_error()
+
+    def get_statement_timeout(self, milliseconds=None):
+        """ The statement timeout in milliseconds, shortened to the time left until the caller's deadline """
+        remaining = remaining_time()
+
+        if remaining is None:
+            return milliseconds
+
+        remaining = max(1, int(remaining * 1000))
+
+        return remaining if not milliseconds else min(milliseconds, remaining)
+
+    def _call_with_query_budget(self, function, *args, **kwargs):
+        """ Call the wrapped method, tracking its queries when RPC_QUERY_BUDGETS is enabled """
+        budget_settings = getattr(settings, "RPC_QUERY_BUDGETS", None)
+
+        if not budget_settings or not budget_settings.get("ENABLED", True):
+            return function(self, *args, **kwargs)
+
+        with track_queries() as stats:
+            result = function(self, *args, **kwargs)
+
+        check_query_budget(type(self).__name__, function.__name__, stats, budget_settings)
+
+        if settings.DEBUG and budget_settings.get("INCLUDE_IN_META", True) \
+                and isinstance(result, dict) and isinstance(result.get("meta"), dict):
+            result["meta"]["queries"] = stats.as_dict()
+
+        return result
+
     def _put_jwt_on_auth_header(self, kwargs):
         jwt = kwargs.pop("jwt", None)
         self.request.META = {
             "HTTP_AUTHORIZATION": "Bearer {0}".format(jwt).encode('UTF-8')
         }
+        return jwt
+
+    def _put_verified_claims_on_request(self, kwargs, jwt):
+        """
+        Put the claims from a gateway signed envelope on the request, see `claims_envelope`.
+        Returns False when there is no envelope or it can't be trusted, so the JWT gets authenticated instead.
+        """
+        envelope = kwargs.pop("claims", None)
+        signing_key = getattr(settings, "CLAIMS_ENVELOPE", {}).get("SIGNING_KEY")
+
+        if envelope is None or not signing_key:
+            return False
+
+        try:
+            self.request.user = verify_claims(envelope, signing_key, locals.get_cid())
+            self.request.auth = jwt
+        except InvalidClaimsEnvelope as ex:
+            self.logger.warning("Ignoring claims envelope, %s", str(ex))
+            return False
+
+        return True
 
     def _set_request_method(self, function_name):
         method = {
@@ -63,15 +183,28 @@ class RpcViewAdapter(object):
     # Implementation borrowed from https://github.com/encode/django-rest-framework/blob/master/rest_framework/views.py
     def get_authenticators(self):
         """
-        Instantiates and returns the list of authenticators that this view can use.
+        Returns the list of authenticators that this view can use.
         """
-        return [auth() for auth in self.authentication_classes]
+        return self._get_policy_instances(self.authentication_classes)
 
     def get_permissions(self):
         """
-        Instantiates and returns the list of permissions that this view requires.
+        Returns the list of permissions that this view requires.
         """
-        return [permission() for permission in self.permission_classes]
+        return self._get_policy_instances(self.permission_classes)
+
+    def _get_policy_instances(self, policy_classes):
+        """
+        Instantiates the policy classes once and reuses the instances for every call, so policies
+        must keep all per-request state on the request rather than on themselves.
+        """
+        key = tuple(policy_classes)
+        instances = _policy_instances.get(key)
+
+        if instances is None:
+            instances = _policy_instances[key] = [policy() for policy in policy_classes]
+
+        return instances
 
     # Modified from original since authentication happens on the request object in DRF.
     def perform_authentication(self):
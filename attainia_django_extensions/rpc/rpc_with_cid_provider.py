@@ -3,10 +3,15 @@ import logging
 from uuid import uuid4
 
 from nameko.extensions import DependencyProvider
-from nameko.standalone.rpc import ClusterRpcProxy
 
 from cid import locals
 
+from .claim_check import ClaimCheckedReply, fetch_payload
+from .deadline import propagate_deadline
+from .profiling import propagate_profile
+from ..tracing.tracer import propagate_trace
+from .resilient_call import call_with_resilience
+
 
 """
 RPC dependency provider with CID
@@ -24,7 +29,9 @@ class RpcWithCidProvider(DependencyProvider):
 
 
     Requires Nameko Config, a simple dependency provider that gives services read-only access
-    to configuration values at run time.
+    to configuration values at run time. Circuit breaking and hedged reads are configured with
+    the optional RPC_RESILIENCE config key, see `resilient_call`. The deadline of the current call
+    is passed on with the CID, see `deadline`.
 
     """
     config = None
@@ -55,15 +62,31 @@ class RpcWithCid():
             # Get the correlation ID if it exists, otherwise create one
             cid = locals.get_cid() or str(uuid4())
 
-            with ClusterRpcProxy(self.config) as cluster_rpc:
-                service = getattr(cluster_rpc, service_name)
-                method = getattr(service, method_name)
-                new_kwargs = {**kwargs, **{"cid": cid}}
-
-                if use_async:
-                    return method.call_async(*args, **new_kwargs)
-                else:
-                    return method(*args, **new_kwargs)
+            new_kwargs = {**kwargs, **{"cid": cid}}
+            propagate_trace(new_kwargs)
+            propagate_profile(new_kwargs)
+            propagate_deadline(new_kwargs, self.config.get("RPC_DEADLINE", {}).get("HOP_MARGIN", 0.0))
+
+            def invoke():
+                # Imported here, the standalone proxy pulls in kombu and is only needed once a call is made.
+                from nameko.standalone.rpc import ClusterRpcProxy
+
+                with ClusterRpcProxy(self.config) as cluster_rpc:
+                    service = getattr(cluster_rpc, service_name)
+                    method = getattr(service, method_name)
+
+                    if use_async:
+                        return ClaimCheckedReply(method.call_async(*args, **new_kwargs))
+                    else:
+                        return fetch_payload(method(*args, **new_kwargs))
+
+            return call_with_resilience(
+                service_name,
+                method_name,
+                use_async,
+                invoke,
+                self.config.get("RPC_RESILIENCE", {}),
+            )
 
         except Exception as ex:
             self.logger.error("RPC call failed with error %s", getattr(ex, 'message', repr(ex)))
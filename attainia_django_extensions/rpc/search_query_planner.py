@@ -0,0 +1,98 @@
+"""
+Planning stage for DjangoSearch queries, keeping the number of OR-groups and lookups bounded.
+
+    Limits are configured with an optional dictionary in the Django settings.
+
+        SEARCH_QUERY_PLANNER = {
+            "MIN_TERM_LENGTH": 2,
+            "MAX_TERMS": 8,
+            "MAX_FAN_OUT": 40,
+            "STATEMENT_TIMEOUT": 2000,  # milliseconds, PostgreSQL only
+        }
+
+    A term ending in `*` (e.g. `acme*`) is a prefix search, which can use an index where a
+    contains search can't.
+
+"""
+from django.conf import settings
+
+
+class SearchBudgetExceeded(Exception):
+    """ Raised when a search would need more terms or lookups than the planner allows """
+    pass
+
+
+class SearchTerm(object):
+    def __init__(self, text: str, prefix: bool = False):
+        self.text = text
+        self.prefix = prefix
+
+    def __eq__(self, other):
+        return isinstance(other, SearchTerm) and (self.text, self.prefix) == (other.text, other.prefix)
+
+    def __hash__(self):
+        return hash((self.text, self.prefix))
+
+    def __repr__(self):
+        return "SearchTerm({0!r}, prefix={1})".format(self.text, self.prefix)
+
+
+class SearchQueryPlanner(object):
+    """ Normalizes search terms and checks the query they would produce against the budget """
+
+    def __init__(self, min_term_length: int = 2, max_terms: int = 8, max_fan_out: int = 40):
+        self.min_term_length = min_term_length
+        self.max_terms = max_terms
+        self.max_fan_out = max_fan_out
+
+    @classmethod
+    def from_settings(cls):
+        planner_settings = getattr(settings, "SEARCH_QUERY_PLANNER", {})
+
+        return cls(
+            min_term_length=planner_settings.get("MIN_TERM_LENGTH", 2),
+            max_terms=planner_settings.get("MAX_TERMS", 8),
+            max_fan_out=planner_settings.get("MAX_FAN_OUT", 40),
+        )
+
+    def normalize_terms(self, search_terms: str, case_sensitive: bool = False):
+        """
+        Split and dedupe terms, dropping those shorter than `min_term_length`. Terms are kept as
+        given and compared case insensitively, as the lookups are, unless `case_sensitive` is set
+        for searches with `$` (regex) fields, where e.g. `\\D` and `\\d` differ.
+        """
+        def compared(text):
+            return text if case_sensitive else text.lower()
+
+        terms = []
+        seen = set()
+
+        for text in search_terms.replace(",", " ").split():
+            prefix = text.endswith("*")
+            text = text.rstrip("*")
+
+            if len(text) < self.min_term_length or (compared(text), prefix) in seen:
+                continue
+
+            seen.add((compared(text), prefix))
+            terms.append(SearchTerm(text, prefix))
+
+        # A contains search for a term already matches everything its prefix search would.
+        contains = {compared(term.text) for term in terms if not term.prefix}
+        return [term for term in terms if not (term.prefix and compared(term.text) in contains)]
+
+    def plan(self, search_terms: str, field_count: int, case_sensitive: bool = False):
+        """ Normalized terms, raising SearchBudgetExceeded if the query would be too expensive """
+        terms = self.normalize_terms(search_terms, case_sensitive)
+
+        if len(terms) > self.max_terms:
+            raise SearchBudgetExceeded(
+                "Search has {0} terms, the maximum is {1}".format(len(terms), self.max_terms)
+            )
+
+        if len(terms) * field_count > self.max_fan_out:
+            raise SearchBudgetExceeded(
+                "Search needs {0} lookups, the maximum is {1}".format(len(terms) * field_count, self.max_fan_out)
+            )
+
+        return terms
@@ -0,0 +1,32 @@
+""" Per-query database statement timeouts """
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+
+# PostgreSQL's query_canceled SQLSTATE, raised when statement_timeout is hit.
+QUERY_CANCELED_PGCODE = "57014"
+
+
+@contextmanager
+def statement_timeout(milliseconds, using=DEFAULT_DB_ALIAS):
+    """
+    Run the block in a transaction whose statements are cancelled after `milliseconds`.
+    Only PostgreSQL is supported, on other databases (or without a timeout) the block runs as is.
+    """
+    connection = connections[using]
+
+    if not milliseconds or connection.vendor != "postgresql":
+        yield
+        return
+
+    with transaction.atomic(using=using):
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL statement_timeout = {0:d}".format(max(1, int(milliseconds))))
+
+        yield
+
+
+def is_statement_timeout(ex: Exception) -> bool:
+    """ Whether a database error was caused by a statement timeout """
+    return getattr(ex.__cause__, "pgcode", None) == QUERY_CANCELED_PGCODE
@@ -0,0 +1,99 @@
+""" Span exporters, each takes a batch of span dictionaries """
+import hashlib
+import json
+import threading
+import urllib.request
+
+
+class SpanExporter(object):
+    """ Interface for span exporters """
+
+    def export(self, spans: list):
+        raise NotImplementedError()
+
+
+class FileSpanExporter(SpanExporter):
+    """ Appends spans to a local file as JSON lines """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        lines = "".join(json.dumps(span, default=str) + "\n" for span in spans)
+
+        with self._lock:
+            with open(self.path, "a") as span_file:
+                span_file.write(lines)
+
+
+class OtlpHttpSpanExporter(SpanExporter):
+    """
+    Posts spans to an OpenTelemetry collector's OTLP/HTTP JSON endpoint, e.g.
+    "http://otel-collector:4318/v1/traces".
+    """
+    span_kinds = {"internal": 1, "server": 2, "client": 3, "producer": 4, "consumer": 5}
+
+    def __init__(self, endpoint: str, headers: dict = None, timeout: float = 5.0, service_name: str = "unknown"):
+        self.endpoint = endpoint
+        self.headers = {**{"Content-Type": "application/json"}, **(headers or {})}
+        self.timeout = timeout
+        self.service_name = service_name
+
+    def _trace_id(self, cid):
+        """ OTLP trace IDs are 16 bytes of hex, which a UUID CID already is """
+        trace_id = cid.replace("-", "")
+
+        if len(trace_id) == 32 and all(char in "0123456789abcdef" for char in trace_id.lower()):
+            return trace_id.lower()
+
+        return hashlib.sha256(cid.encode("utf-8")).hexdigest()[:32]
+
+    def _attribute(self, key, value):
+        if isinstance(value, bool):
+            return {"key": key, "value": {"boolValue": value}}
+
+        if isinstance(value, int):
+            return {"key": key, "value": {"intValue": str(value)}}
+
+        if isinstance(value, float):
+            return {"key": key, "value": {"doubleValue": value}}
+
+        return {"key": key, "value": {"stringValue": str(value)}}
+
+    def _otlp_span(self, span):
+        otlp_span = {
+            "traceId": self._trace_id(span["trace_id"]),
+            "spanId": span["span_id"],
+            "name": span["name"],
+            "kind": self.span_kinds.get(span["kind"], 1),
+            "startTimeUnixNano": str(int(span["start_time"] * 1e9)),
+            "endTimeUnixNano": str(int(span["end_time"] * 1e9)),
+            "attributes": [self._attribute(key, value) for key, value in span["attributes"].items()],
+            "status": {"code": 2, "message": span["error"]} if span["error"] else {"code": 1},
+        }
+
+        if span["parent_id"]:
+            otlp_span["parentSpanId"] = span["parent_id"]
+
+        return otlp_span
+
+    def export(self, spans):
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": [self._attribute("service.name", self.service_name)]},
+                "scopeSpans": [{
+                    "scope": {"name": "attainia_django_extensions"},
+                    "spans": [self._otlp_span(span) for span in spans],
+                }],
+            }]
+        }
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(body).encode("utf-8"),
+            headers=self.headers,
+            method="POST",
+        )
+
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
@@ -0,0 +1,258 @@
+"""
+Lightweight tracing spans on top of the CID propagation.
+
+    The CID is the trace ID. The gateway's error marshaller, rpc_decorator_with_cid and
+    event_handler_decorator_with_cid each record a span, and the RPC mixins and EventDispatchWithCidMixin
+    pass the current span on as the `trace` kwarg (or event data key) so the next hop's span is its child.
+
+    Whether a trace is recorded is decided once, where it starts, and every hop follows that decision.
+    Recorded spans are queued and exported in batches from a background thread.
+
+        TRACING = {
+            "SAMPLE_RATE": 0.1,
+            "SERVICE_NAME": "asset_service",
+            "EXPORTER": "attainia_django_extensions.tracing.exporters.FileSpanExporter",
+            "EXPORTER_OPTIONS": {"path": "/var/log/spans.jsonl"},
+            "BATCH_SIZE": 100,
+            "FLUSH_INTERVAL": 5,
+            "MAX_QUEUE_SIZE": 2048,
+        }
+
+"""
+import atexit
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from cid import locals
+
+
+SERVER = "server"
+CONSUMER = "consumer"
+INTERNAL = "internal"
+
+# The current span context, per request (see the note on `rpc.deadline._deadline`).
+_context = ContextVar("trace_context", default=None)
+
+
+class Span(object):
+    """ A timed operation within a trace """
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "start_time", "end_time",
+                 "attributes", "error", "_started_at")
+
+    def __init__(self, trace_id, span_id, parent_id, name, kind=INTERNAL, attributes=None):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_time = time.time()
+        self.end_time = None
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self._started_at = time.perf_counter()
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def finish(self):
+        self.end_time = self.start_time + (time.perf_counter() - self._started_at)
+
+    def as_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration": round((self.end_time - self.start_time) * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+def _new_span_id():
+    return os.urandom(8).hex()
+
+
+def get_trace_context():
+    """ The context to pass to the next hop, or None outside of a span """
+    return _context.get()
+
+
+def propagate_trace(kwargs: dict):
+    """ Add the current span context to the kwargs of an outgoing RPC or to event data """
+    context = get_trace_context()
+
+    if context is not None:
+        kwargs["trace"] = context
+
+    return kwargs
+
+
+class Tracer(object):
+    """ Starts spans and exports the sampled ones in batches """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, exporter, sample_rate: float = 1.0, service_name: str = None, batch_size: int = 100,
+                 flush_interval: float = 5.0, max_queue_size: int = 2048):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.service_name = service_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue = deque(maxlen=max_queue_size)
+        self._flush_event = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def _is_sampled(self, parent):
+        if parent is not None:
+            return bool(parent.get("sampled"))
+
+        return random.random() < self.sample_rate
+
+    @contextmanager
+    def start_span(self, name: str, kind: str = INTERNAL, parent: dict = None, attributes: dict = None):
+        """
+        Time the block as a span, the child of `parent` (a propagated context) or of the current span.
+        Yields the Span, or None when the trace isn't sampled.
+        """
+        previous = get_trace_context()
+        parent = parent if parent is not None else previous
+
+        if not self._is_sampled(parent):
+            token = _context.set({"sampled": False})
+
+            try:
+                yield None
+            finally:
+                _context.reset(token)
+
+            return
+
+        trace_id = locals.get_cid()
+
+        if trace_id is None:
+            # Start the trace here, and give every hop after this one the same CID.
+            trace_id = str(uuid4())
+            locals.set_cid(trace_id)
+
+        span = Span(trace_id, _new_span_id(), parent.get("span_id") if parent else None, name, kind, attributes)
+
+        if self.service_name:
+            span.set_attribute("service.name", self.service_name)
+
+        token = _context.set({"span_id": span.span_id, "sampled": True})
+
+        try:
+            yield span
+        except Exception as ex:
+            span.error = repr(ex)
+            raise
+        finally:
+            _context.reset(token)
+            span.finish()
+            self.record(span)
+
+    def record(self, span: Span):
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+
+        self._queue.append(span)
+        self._ensure_flush_thread()
+
+        if len(self._queue) >= self.batch_size:
+            self._flush_event.set()
+
+    def _ensure_flush_thread(self):
+        if self._thread is not None:
+            return
+
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._flush_event.wait(self.flush_interval)
+            self._flush_event.clear()
+            self.flush()
+
+    def flush(self):
+        """ Export every queued span, in batches of `batch_size` """
+        with self._flush_lock:
+            while self._queue:
+                batch = []
+
+                while self._queue and len(batch) < self.batch_size:
+                    batch.append(self._queue.popleft())
+
+                try:
+                    self.exporter.export([span.as_dict() for span in batch])
+                except Exception as ex:
+                    self.logger.warning("Exporting %s spans failed with error %s", len(batch), repr(ex))
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer():
+    """ Process wide Tracer built from the TRACING setting, or None if it isn't configured """
+    global _tracer
+
+    try:
+        tracing_settings = getattr(settings, "TRACING", None)
+    except ImproperlyConfigured:
+        # A Nameko service that isn't hosting Django.
+        return None
+
+    if not tracing_settings:
+        return None
+
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                exporter_class = import_string(
+                    tracing_settings.get("EXPORTER", "attainia_django_extensions.tracing.exporters.FileSpanExporter")
+                )
+                _tracer = Tracer(
+                    exporter_class(**tracing_settings.get("EXPORTER_OPTIONS", {})),
+                    sample_rate=tracing_settings.get("SAMPLE_RATE", 1.0),
+                    service_name=tracing_settings.get("SERVICE_NAME"),
+                    batch_size=tracing_settings.get("BATCH_SIZE", 100),
+                    flush_interval=tracing_settings.get("FLUSH_INTERVAL", 5),
+                    max_queue_size=tracing_settings.get("MAX_QUEUE_SIZE", 2048),
+                )
+
+    return _tracer
+
+
+@contextmanager
+def trace_span(name: str, kind: str = INTERNAL, parent: dict = None, attributes: dict = None):
+    """ Tracer.start_span on the process wide tracer, a no-op yielding None when tracing isn't configured """
+    tracer = get_tracer()
+
+    if tracer is None:
+        yield None
+        return
+
+    with tracer.start_span(name, kind, parent, attributes) as span:
+        yield span
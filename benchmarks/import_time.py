@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+Import-time benchmark for the package's modules.
+
+Each module is imported in a fresh interpreter with `python -X importtime`, after Django itself has
+been set up with django-cid installed, as the projects using this package have it, so the numbers
+are what the module adds to a worker's cold start. Exits non-zero when a module goes over its
+budget or fails to import.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --budget 50 --runs 5 attainia_django_extensions.rpc.rpc_decorator_with_cid
+
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+
+# Budgets in milliseconds, modules not listed here get --budget. The Nameko dependency providers
+# and the event dispatch mixin can't be defined without Nameko, which brings in eventlet, nor the
+# gateway viewset without DRF's viewsets.
+BUDGETS = {
+    "attainia_django_extensions.jwt": 10,
+    "attainia_django_extensions.utils": 20,
+    "attainia_django_extensions.events.event_handler_decorator_with_cid": 10,
+    "attainia_django_extensions.rpc.rpc_decorator_with_cid": 10,
+    "attainia_django_extensions.rpc.django_rpc_with_cid_mixin": 20,
+    "attainia_django_extensions.events.event_dispatch_with_cid_mixin": 300,
+    "attainia_django_extensions.rpc.rpc_with_cid_provider": 300,
+    "attainia_django_extensions.rpc.django_data_access_provider": 300,
+    "attainia_django_extensions.rpc.django_search_provider": 300,
+    "attainia_django_extensions.gateway.http_rpc_viewset": 300,
+}
+
+MODULES = [
+    "attainia_django_extensions.jwt",
+    "attainia_django_extensions.utils",
+    "attainia_django_extensions.events.event_dispatch_with_cid_mixin",
+    "attainia_django_extensions.events.event_handler_decorator_with_cid",
+    "attainia_django_extensions.rpc.rpc_decorator_with_cid",
+    "attainia_django_extensions.rpc.rpc_with_cid_provider",
+    "attainia_django_extensions.rpc.django_rpc_with_cid_mixin",
+    "attainia_django_extensions.rpc.django_data_access_provider",
+    "attainia_django_extensions.rpc.django_search_provider",
+    "attainia_django_extensions.gateway.http_rpc_viewset",
+]
+
+SETUP = (
+    "import django\n"
+    "from django.conf import settings\n"
+    "settings.configure(\n"
+    "    INSTALLED_APPS=['django.contrib.contenttypes', 'django.contrib.auth', 'cid.apps.CidAppConfig'],\n"
+    ")\n"
+    "django.setup()\n"
+)
+
+
+def measure(module):
+    """ Cumulative import time of the module in microseconds """
+    code = SETUP + "import {0}\n".format(module)
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [os.getcwd(), os.environ.get("PYTHONPATH")]))}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        env=env,
+    )
+
+    if result.returncode != 0:
+        raise RuntimeError("Importing {0} failed:\n{1}".format(module, result.stderr))
+
+    # Lines look like "import time:       123 |       4567 |   package.module"
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+
+        _, cumulative, name = line[len("import time:"):].split("|")
+
+        if name.strip() == module:
+            return int(cumulative)
+
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--budget", type=float, default=100, help="default budget per module in milliseconds")
+    parser.add_argument("--runs", type=int, default=3, help="take the best of this many runs")
+    args = parser.parse_args()
+
+    over_budget = []
+
+    for module in args.modules:
+        try:
+            elapsed = min(measure(module) for _ in range(args.runs)) / 1000.0
+        except RuntimeError as ex:
+            print("{0:<70} FAILED\n{1}".format(module, str(ex).splitlines()[-1]))
+            over_budget.append(module)
+            continue
+
+        budget = BUDGETS.get(module, args.budget)
+        flag = "OVER" if elapsed > budget else "ok"
+        print("{0:<70} {1:>8.1f} ms  (budget {2:.0f} ms)  {3}".format(module, elapsed, budget, flag))
+
+        if elapsed > budget:
+            over_budget.append(module)
+
+    if over_budget:
+        print("\n{0} module(s) over budget or failing".format(len(over_budget)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
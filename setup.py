@@ -20,6 +20,11 @@ AUTHOR = "Attainia"
 
 REQUIRED = ["django-cid", ]
 
+# Optional packages, e.g. pip install attainia_django_extensions[async]
+EXTRAS = {
+    "async": ["aio-pika"],
+}
+
 here = os.path.abspath(os.path.dirname(__file__))
 
 with io.open(os.path.join(here, "README.md"), encoding="utf-8") as f:
@@ -73,7 +78,9 @@ setup(
     url=URL,
     packages=find_packages(exclude=("tests",)),
     install_requires=REQUIRED,
+    extras_require=EXTRAS,
     include_package_data=True,
+    python_requires=">=3.8",
     license="MIT",
     classifiers=[
         # Trove classifiers
@@ -81,10 +88,12 @@ setup(
         "License :: OSI Approved :: MIT License",
         "Programming Language :: Python",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.3",
-        "Programming Language :: Python :: 3.4",
-        "Programming Language :: Python :: 3.5",
-        "Programming Language :: Python :: 3.6",
+        "Programming Language :: Python :: 3 :: Only",
+        "Programming Language :: Python :: 3.8",
+        "Programming Language :: Python :: 3.9",
+        "Programming Language :: Python :: 3.10",
+        "Programming Language :: Python :: 3.11",
+        "Programming Language :: Python :: 3.12",
         "Programming Language :: Python :: Implementation :: CPython",
         "Programming Language :: Python :: Implementation :: PyPy"
     ],
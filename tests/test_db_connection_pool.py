@@ -0,0 +1,80 @@
+import os
+import tempfile
+import threading
+
+import pytest
+
+django = pytest.importorskip("django")
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(
+        DATABASES={
+            "default": {
+                "ENGINE": "django.db.backends.sqlite3",
+                "NAME": os.path.join(tempfile.mkdtemp(), "pool.sqlite3"),
+                "CONN_MAX_AGE": 300,
+            }
+        },
+    )
+    django.setup()
+
+from django.db import connections, transaction
+
+from attainia_django_extensions.rpc.db_connection_pool import DbConnectionPool
+
+
+def run_in_worker(pool, work):
+    """ Run `work` the way a Nameko worker would, in a thread of its own between acquire and release """
+    outcome = {}
+
+    def worker():
+        pool.acquire()
+
+        try:
+            outcome["result"] = work()
+        except BaseException as ex:
+            outcome["error"] = ex
+        finally:
+            pool.release()
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+
+    if "error" in outcome:
+        raise outcome["error"]
+
+    return outcome["result"]
+
+
+def test_reused_connection_is_kept_and_runs_atomic():
+    pool = DbConnectionPool(["default"], max_connections=1)
+
+    def create_table():
+        with connections["default"].cursor() as cursor:
+            cursor.execute("CREATE TABLE IF NOT EXISTS pooled_item (id integer)")
+
+        return connections["default"].connection
+
+    def insert_atomically():
+        wrapper = connections["default"]
+        raw_connection = wrapper.connection
+
+        assert wrapper.get_autocommit()
+
+        with transaction.atomic():
+            with wrapper.cursor() as cursor:
+                cursor.execute("INSERT INTO pooled_item VALUES (1)")
+
+        return raw_connection
+
+    raw_connection = run_in_worker(pool, create_table)
+    assert pool.stats() == {"default": 1}
+
+    assert run_in_worker(pool, insert_atomically) is raw_connection
+    assert pool.stats() == {"default": 1}
+
+    assert run_in_worker(pool, insert_atomically) is raw_connection
+    assert pool.stats() == {"default": 1}